@@ -0,0 +1,41 @@
+"""Create table Job
+
+Revision ID: 3f9a1c2e7b4d
+Revises: b5115239219d
+Create Date: 2026-10-19 10:12:31.408215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "3f9a1c2e7b4d"
+down_revision = "b5115239219d"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "job",
+        sa.Column("id", sa.BigInteger(), nullable=False),
+        sa.Column("kind", sa.String(), nullable=False),
+        sa.Column("payload", sa.Text(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(),
+            server_default=sa.func.now(),
+            nullable=False,
+        ),
+        sa.Column("claimed_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_job_status"), "job", ["status"])
+
+
+def downgrade():
+    op.drop_index(op.f("ix_job_status"), table_name="job")
+    op.drop_table("job")
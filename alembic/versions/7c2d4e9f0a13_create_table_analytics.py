@@ -0,0 +1,44 @@
+"""Create table Analytics
+
+Revision ID: 7c2d4e9f0a13
+Revises: 3f9a1c2e7b4d
+Create Date: 2026-10-19 11:40:05.912377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "7c2d4e9f0a13"
+down_revision = "3f9a1c2e7b4d"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "analytics",
+        sa.Column("id", sa.BigInteger(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("chat_id", sa.BigInteger(), nullable=True),
+        sa.Column("link_type", sa.Integer(), nullable=False),
+        sa.Column("provider", sa.String(), nullable=True),
+        sa.Column("resolve_time", sa.Float(), nullable=False),
+        sa.Column("download_time", sa.Float(), nullable=False),
+        sa.Column("convert_time", sa.Float(), nullable=False),
+        sa.Column("upload_time", sa.Float(), nullable=False),
+        sa.Column("total_time", sa.Float(), nullable=False),
+        sa.Column("bytes_in", sa.BigInteger(), nullable=False),
+        sa.Column("bytes_out", sa.BigInteger(), nullable=False),
+        sa.Column("outcome", sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_analytics_created_at"), "analytics", ["created_at"]
+    )
+
+
+def downgrade():
+    op.drop_index(op.f("ix_analytics_created_at"), table_name="analytics")
+    op.drop_table("analytics")
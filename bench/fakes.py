@@ -0,0 +1,390 @@
+"""Stand-in services for benchmarks
+
+Local http server, which pretends to be every service the bot talks to:
+extractor APIs, media hosts, Twitter API v2, Telegram Bot API (public, or
+local one, which reads uploads by `file://` path) and log upload endpoint.
+Original host is the first part of the path:
+`http://127.0.0.1:PORT/<host>/<path>`. APIs return recorded responses from
+`responses.json`, media is generated once at start. Latency and failure rate
+can be set for every service.
+
+Usage:
+    python -m bench.fakes [--port N] [--latency SERVICE=MS]
+                          [--fail SERVICE=RATE] [--video-size BYTES]
+                          [--no-ranges] [--media-rate BYTES]
+"""
+import io
+import re
+import base64
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+import itertools
+
+from string import Template
+from pathlib import Path
+from collections import Counter
+from urllib.parse import urlsplit, parse_qs, unquote, unquote_plus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# recorded responses, `$id` is replaced with requested id
+responses = {
+    key: Template(json.dumps(value))
+    for key, value in json.loads(
+        (Path(__file__).parent / "responses.json").read_text()
+    ).items()
+}
+
+# service of every faked host, anything else is media
+hosts = {
+    "vm.tiktok.com": "tiktok",
+    "vt.tiktok.com": "tiktok",
+    "api.tikmate.app": "tikmate",
+    "lovetik.com": "lovetik",
+    "youtube4kdownloader.com": "youtube4k",
+    "instadownloader.co": "instadownloader",
+    "instagramdownloads.com": "instagramdownloads",
+    "api.sssgram.com": "sssgram",
+    "api.savetube.me": "savetube",
+    "ssyoutube.com": "ssyoutube",
+    "tweetpik.com": "tweetpik",
+    "api.twitter.com": "twitter",
+    "api.telegram.org": "telegram",
+    "script.google.com": "upload",
+}
+
+# telegram methods, which can get media by link
+media_methods = {
+    "sendPhoto",
+    "sendVideo",
+    "sendDocument",
+    "sendAnimation",
+    "sendMediaGroup",
+}
+
+# telegram message ids
+message_ids = itertools.count(1)
+
+
+def render(key: str, _id: str) -> bytes:
+    """Get recorded response with requested id"""
+    return responses[key].substitute(id=_id).encode()
+
+
+def make_jpeg(width: int = 1200, height: int = 800) -> bytes:
+    """Generate noisy jpeg image, which doesn't compress too well"""
+    from PIL import Image
+
+    image = Image.effect_noise((width, height), 64).convert("RGB")
+    with io.BytesIO() as buffer:
+        image.save(buffer, format="jpeg", quality=90)
+        return buffer.getvalue()
+
+
+def make_mp4(size: int) -> bytes:
+    """Generate file with mp4 header of given size"""
+    header = b"\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom"
+    return header + bytes(max(size - len(header), 0))
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        url = urlsplit(self.path)
+        host, _, path = url.path[1:].partition("/")
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if host == "_stats":
+            return self.reply(200, json.dumps(self.server.stats).encode())
+        service = hosts.get(host, "media")
+        with self.server.lock:
+            self.server.stats[service] += 1
+        config = self.server.config
+        if delay := config.get("latency", service):
+            time.sleep(random.uniform(0.5, 1.5) * delay / 1000)
+        fail = random.random() < config.get("fail", service)
+        self.route(service, f"/{path}", query, body, fail)
+
+    do_POST = do_HEAD = do_GET
+
+    def reply(self, status: int, content: bytes, **headers) -> None:
+        self.send_response(status)
+        headers.setdefault("Content-Type", "application/json")
+        for key, value in headers.items():
+            self.send_header(key.replace("_", "-"), value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(content)
+
+    def route(
+        self,
+        service: str,
+        path: str,
+        query: dict[str, str],
+        body: bytes,
+        fail: bool,
+    ) -> None:
+        if service == "telegram":
+            return self.telegram(path.rsplit("/", 1)[-1], body, fail)
+        if service == "upload":
+            return self.upload(query, body, fail)
+        if fail:
+            return self.reply(503, b"Service Unavailable", Content_Type="text")
+        text = unquote_plus(body.decode(errors="ignore"))
+        match service:
+            case "tiktok":
+                _id = 7_000_000_000_000_000_000 + zlib.crc32(path.encode())
+                location = f"https://www.tiktok.com/@bench/video/{_id}"
+                return self.reply(301, b"", Location=location)
+            case "tikmate" | "lovetik" | "youtube4k":
+                _id = re.search(r"\d{5,}", text or query.get("video", ""))
+                return self.reply(200, render(service, _id[0]))
+            case "instadownloader" | "sssgram":
+                code = query.get("url", "").strip("/").rsplit("/", 1)[-1]
+                return self.reply(200, render(service, code))
+            case "instagramdownloads":
+                if path != "/api/post":
+                    return self.reply(
+                        200, b"", Content_Type="text/html", Set_Cookie="b=1"
+                    )
+                code = json.loads(body)["shortcode"]
+                return self.reply(200, render(service, code))
+            case "savetube" | "ssyoutube":
+                if path.endswith("/en6/"):
+                    return self.reply(
+                        200, b"", Content_Type="text/html", Set_Cookie="b=1"
+                    )
+                _id = query.get("url", "").rsplit("/", 1)[-1]
+                return self.reply(200, render(service, _id))
+            case "tweetpik":
+                return self.reply(200, render(service, path.split("/")[3]))
+            case "twitter":
+                return self.twitter(query["ids"].split(","))
+        # media: images by extension or format, videos otherwise
+        if path.endswith(".jpg") or query.get("format", None) == "jpg":
+            return self.media(self.server.jpeg, "image/jpeg")
+        return self.media(self.server.mp4, "video/mp4")
+
+    def media(self, content: bytes, content_type: str) -> None:
+        etag = f'"{zlib.crc32(content):08x}"'
+        headers = {"Content_Type": content_type, "ETag": etag}
+        # cached for a week, like twitter images are
+        if content_type == "image/jpeg":
+            headers["Cache_Control"] = f"max-age={self.server.max_age}"
+        if self.headers.get("If-None-Match", "") == etag:
+            return self.reply(304, b"", **headers)
+        status, total = 200, len(content)
+        # partial content, like CDNs do
+        if self.server.ranges:
+            headers["Accept_Ranges"] = "bytes"
+            if match := re.fullmatch(
+                r"bytes=(\d+)-(\d*)", self.headers.get("Range", "")
+            ):
+                start = int(match[1])
+                end = min(int(match[2] or total - 1), total - 1)
+                status, content = 206, content[start : end + 1]
+                headers["Content_Range"] = f"bytes {start}-{end}/{total}"
+        if not (rate := self.server.media_rate) or self.command == "HEAD":
+            return self.reply(status, content, **headers)
+        # throttle every connection, like CDNs do
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key.replace("_", "-"), value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        for n in range(0, len(content), block := 1 << 16):
+            self.wfile.write(content[n : n + block])
+            time.sleep(block / rate)
+
+    def twitter(self, ids: list[str]) -> None:
+        # even ids are photos, odd ids are videos
+        data, media = [], []
+        for _id in ids:
+            data.append(json.loads(render("tweet", _id)))
+            kind = "tweet_video" if int(_id) % 2 else "tweet_photo"
+            media.append(json.loads(render(kind, _id)))
+        content = {
+            "data": data,
+            "includes": {
+                "users": [json.loads(render("tweet_user", ""))],
+                "media": media,
+            },
+        }
+        self.reply(
+            200,
+            json.dumps(content).encode(),
+            x_rate_limit_limit="900",
+            x_rate_limit_remaining="899",
+            x_rate_limit_reset=str(int(time.time()) + 900),
+        )
+
+    def upload(self, query: dict[str, str], body: bytes, fail: bool) -> None:
+        # log upload endpoint, appends chunk at expected offset
+        if fail:
+            return self.reply(503, b"Service Unavailable", Content_Type="text")
+        with self.server.lock:
+            file = self.server.uploads.setdefault(query["name"], bytearray())
+            if int(query["offset"]) == len(file):
+                file += base64.urlsafe_b64decode(body)
+                content = {"ok": True, "offset": len(file)}
+            else:
+                content = {"ok": False, "offset": len(file)}
+        self.reply(200, json.dumps(content).encode())
+
+    def telegram(self, method: str, body: bytes, fail: bool) -> None:
+        # failure means telegram couldn't get media by link
+        if fail and method in media_methods and b"https://" in body:
+            content = {
+                "ok": False,
+                "error_code": 400,
+                "description": "Bad Request: failed to get HTTP URL content",
+            }
+            return self.reply(400, json.dumps(content).encode())
+        # local mode reads uploaded files by path
+        for uri in re.findall(rb'"file://([^"]+)"', body):
+            if not (file := Path(unquote(uri.decode()))).is_file():
+                content = {
+                    "ok": False,
+                    "error_code": 400,
+                    "description": "Bad Request: file not found",
+                }
+                return self.reply(400, json.dumps(content).encode())
+            with self.server.lock:
+                self.server.stats["local_files"] += 1
+                self.server.stats["local_bytes"] += file.stat().st_size
+        message = {
+            "message_id": next(message_ids),
+            "date": int(time.time()),
+            "chat": {"id": 1, "type": "private", "first_name": "Bench"},
+        }
+        match method:
+            case "getMe":
+                result = {
+                    "id": 123456,
+                    "is_bot": True,
+                    "first_name": "Benchmark",
+                    "username": "benchmark_bot",
+                }
+            case "sendMediaGroup":
+                result = [message]
+            case "sendChatAction" | "answerInlineQuery":
+                result = True
+            case _:
+                result = message
+        self.reply(200, json.dumps({"ok": True, "result": result}).encode())
+
+
+class Config:
+    """Latency (ms) and failure rate of every service, `*` for the rest"""
+
+    def __init__(self, latency: dict[str, float], fail: dict[str, float]):
+        self.values = {"latency": latency, "fail": fail}
+
+    def get(self, key: str, service: str) -> float:
+        values = self.values[key]
+        return values.get(service, values.get("*", 0.0))
+
+
+def start(
+    port: int = 0,
+    latency: dict[str, float] = None,
+    fail: dict[str, float] = None,
+    video_size: int = 2 << 20,
+    ranges: bool = True,
+    media_rate: int = 0,
+) -> ThreadingHTTPServer:
+    """Start stand-in services in background thread
+
+    Args:
+        port (int, optional): port, 0 for any free one. Defaults to 0.
+        latency (dict[str, float], optional): service -> latency in ms.
+        Defaults to 50 ms for every service.
+        fail (dict[str, float], optional): service -> failure rate. Defaults
+        to no failures.
+        video_size (int, optional): size of served videos. Defaults to 2 MB.
+        ranges (bool, optional): serve media in parts on `Range` requests.
+        Defaults to True.
+        media_rate (int, optional): bytes per second of every media
+        connection, 0 for no limit. Defaults to 0.
+
+    Returns:
+        ThreadingHTTPServer: running server
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.config = Config(latency or {"*": 50.0}, fail or {})
+    server.stats, server.lock = Counter(), threading.Lock()
+    # uploaded log files: name -> content
+    server.uploads = {}
+    server.jpeg, server.mp4 = make_jpeg(), make_mp4(video_size)
+    server.ranges, server.media_rate = ranges, media_rate
+    server.max_age = 604800
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def pairs(value: str) -> tuple[str, float]:
+    """Parse `SERVICE=VALUE` argument"""
+    key, _, number = value.rpartition("=")
+    return key or "*", float(number)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--port", type=int, default=0, help="0 for any")
+    parser.add_argument(
+        "--latency",
+        type=pairs,
+        action="append",
+        default=[],
+        help="SERVICE=MS, service is one of: * (default 50), %s"
+        % ", ".join(sorted(set(hosts.values()) | {"media"})),
+    )
+    parser.add_argument(
+        "--fail",
+        type=pairs,
+        action="append",
+        default=[],
+        help="SERVICE=RATE, failure rate from 0 to 1, for telegram it is "
+        "the rate of media, which can't be fetched by link",
+    )
+    parser.add_argument(
+        "--video-size", type=int, default=2 << 20, help="bytes per video"
+    )
+    parser.add_argument(
+        "--no-ranges", action="store_true", help="ignore `Range` of media"
+    )
+    parser.add_argument(
+        "--media-rate",
+        type=int,
+        default=0,
+        help="bytes per second of every media connection, 0 for no limit",
+    )
+    args = parser.parse_args()
+
+    server = start(
+        args.port,
+        {"*": 50.0, **dict(args.latency)},
+        dict(args.fail),
+        args.video_size,
+        not args.no_ranges,
+        args.media_rate,
+    )
+    print("listening", server.server_address[1], flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""End-to-end benchmark
+
+Drives `echo` and `inliner` of the bot with generated updates under load.
+Every request to the outside world goes to local stand-in services (see
+`bench.fakes`), started in a separate process, so only the bot is measured.
+Reports messages per second, latency percentiles and peak RSS.
+
+Usage:
+    python -m bench.load [--messages N] [--concurrency N] [--inline RATIO]
+                         [--mix TYPE=WEIGHT] [--latency SERVICE=MS]
+                         [--fail SERVICE=RATE] [--video-size BYTES]
+                         [--local-api] [--no-ranges] [--media-rate BYTES]
+"""
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import resource
+import tempfile
+import statistics
+import subprocess
+
+from pathlib import Path
+from datetime import datetime
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+# parse `SERVICE=VALUE` arguments like stand-in services do
+from bench.fakes import pairs
+
+# repository root
+root = Path(__file__).parent.parent
+
+# message text for every link type
+texts = {
+    "twitter": "https://twitter.com/bench/status/{n}",
+    "tiktok": "https://www.tiktok.com/@bench/video/{n:019d}",
+    "vtiktok": "https://vm.tiktok.com/ZM{n:07d}/",
+    "instagram": "https://www.instagram.com/p/B{n:010d}/",
+    "youtube": "https://www.youtube.com/shorts/Y{n:010d}",
+    "pixiv": "https://www.pixiv.net/artworks/{n}",
+}
+
+
+def start_fakes(args: argparse.Namespace) -> tuple[subprocess.Popen, int]:
+    """Start stand-in services in child process
+
+    Returns:
+        tuple[subprocess.Popen, int]: child process and its port
+    """
+    cmd = [sys.executable, "-m", "bench.fakes", "--video-size", args.video_size]
+    for key, value in args.latency:
+        cmd += ["--latency", f"{key}={value}"]
+    for key, value in args.fail:
+        cmd += ["--fail", f"{key}={value}"]
+    if getattr(args, "no_ranges", False):
+        cmd += ["--no-ranges"]
+    cmd += ["--media-rate", getattr(args, "media_rate", 0)]
+    proc = subprocess.Popen(
+        list(map(str, cmd)), cwd=root, stdout=subprocess.PIPE, text=True
+    )
+    _, port = proc.stdout.readline().split()
+    return proc, int(port)
+
+
+def redirect(port: int) -> None:
+    """Send every request made with `requests` to stand-in services"""
+    from requests.adapters import HTTPAdapter
+
+    send = HTTPAdapter.send
+
+    def wrapper(self, request, **kwargs):
+        url = urlsplit(request.url)
+        query = f"?{url.query}" if url.query else ""
+        request.url = f"http://127.0.0.1:{port}/{url.netloc}{url.path}{query}"
+        return send(self, request, **kwargs)
+
+    HTTPAdapter.send = wrapper
+
+
+def set_env(directory: str) -> None:
+    """Environment of the bot, no real services or database needed"""
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{directory}/bench.db")
+    os.environ.setdefault("PATH_SETTINGS", str(root / "settings.toml"))
+    os.environ.setdefault("TW_TOKEN", "benchmark")
+    os.environ.setdefault("CACHE_DIR", f"{directory}/cache")
+    os.environ["TOKEN"] = "123456:benchmark"
+    os.environ["JOB_QUEUE"] = "0"
+    os.environ["SEND_DELAY"] = "0"
+
+
+def make_bot(port: int, pool_size: int):
+    """Create database tables and bot, which talks to stand-in Telegram
+
+    Args:
+        port (int): port of stand-in services
+        pool_size (int): number of connections
+
+    Returns:
+        Bot: telegram bot object
+    """
+    from telegram import Bot
+    from telegram.utils.request import Request
+
+    from db import engine
+    from db.models import Base
+
+    Base.metadata.create_all(engine)
+    return Bot(
+        os.environ["TOKEN"],
+        base_url=f"http://127.0.0.1:{port}/api.telegram.org/bot",
+        request=Request(con_pool_size=pool_size),
+    )
+
+
+def make_update(n: int, kind: str, link: str, chats: int) -> dict:
+    """Generate telegram update with link"""
+    user = {"id": n % chats + 1, "is_bot": False, "first_name": "Bench"}
+    if kind == "inline":
+        return {
+            "update_id": n,
+            "inline_query": {
+                "id": str(n),
+                "from": user,
+                "query": link,
+                "offset": "",
+            },
+        }
+    return {
+        "update_id": n,
+        "message": {
+            "message_id": n,
+            "date": int(datetime.now().timestamp()),
+            "chat": {**user, "type": "private"},
+            "from": user,
+            "text": link,
+        },
+    }
+
+
+def percentiles(values: list[float]) -> str:
+    """Format p50, p90, p99 and max in milliseconds"""
+    if len(values) < 2:
+        values = values * 2 or [0.0, 0.0]
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return "p50 {:8.1f}  p90 {:8.1f}  p99 {:8.1f}  max {:8.1f} ms".format(
+        cuts[49] * 1000, cuts[89] * 1000, cuts[98] * 1000, max(values) * 1000
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="handler threads"
+    )
+    parser.add_argument(
+        "--inline", type=float, default=0.2, help="ratio of inline queries"
+    )
+    parser.add_argument(
+        "--mix",
+        type=pairs,
+        action="append",
+        default=[],
+        help="TYPE=WEIGHT, type is one of: %s" % ", ".join(texts),
+    )
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--latency", type=pairs, action="append", default=[])
+    parser.add_argument("--fail", type=pairs, action="append", default=[])
+    parser.add_argument("--video-size", type=int, default=2 << 20)
+    parser.add_argument(
+        "--no-ranges", action="store_true", help="media without `Range`"
+    )
+    parser.add_argument(
+        "--media-rate", type=int, default=0, help="bytes/s per connection"
+    )
+    parser.add_argument(
+        "--local-api",
+        action="store_true",
+        help="upload by path like to local Bot API server",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    random.seed(args.seed)
+    mix = dict(args.mix) or dict.fromkeys(texts, 1.0)
+
+    fakes, port = start_fakes(args)
+    directory = tempfile.TemporaryDirectory()
+    try:
+        set_env(directory.name)
+        if args.local_api:
+            os.environ["BOT_API_URL"] = (
+                f"http://127.0.0.1:{port}/api.telegram.org/bot"
+            )
+        redirect(port)
+
+        import main as bot
+
+        from telegram import Update
+        from telegram.ext import Updater, CallbackContext
+
+        tg = make_bot(port, args.concurrency + 4)
+        context = CallbackContext(Updater(bot=tg).dispatcher)
+
+        # generate updates
+        updates = []
+        for n in range(1, args.messages + 1):
+            kind = "inline" if random.random() < args.inline else "echo"
+            link = random.choices(list(mix), weights=list(mix.values()))[0]
+            update = make_update(n, kind, texts[link].format(n=n), args.chats)
+            updates.append((kind, Update.de_json(update, tg)))
+
+        def handle(kind: str, update: Update) -> tuple[str, float, bool]:
+            start = time.perf_counter()
+            try:
+                (bot.inliner if kind == "inline" else bot.echo)(update, context)
+                ok = True
+            except Exception as ex:
+                logging.error("Benchmark: %s failed: %r.", kind, ex)
+                ok = False
+            return kind, time.perf_counter() - start, ok
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            results = list(pool.map(lambda item: handle(*item), updates))
+        wall = time.perf_counter() - start
+
+        import requests
+
+        from extra.cache import cache
+
+        stats = requests.get("https://_stats/").json()
+    finally:
+        fakes.terminate()
+        directory.cleanup()
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    errors = sum(not ok for _, _, ok in results)
+    print(f"messages:    {len(results)} ({errors} failed)")
+    print(f"concurrency: {args.concurrency}")
+    print(f"wall time:   {wall:.2f} s")
+    print(f"throughput:  {len(results) / wall:.1f} msg/s")
+    print(f"all:    {percentiles([r[1] for r in results])}")
+    for kind in ("echo", "inline"):
+        if values := [r[1] for r in results if r[0] == kind]:
+            print(f"{kind + ':':7} {percentiles(values)}")
+    print(f"peak RSS:    {rss / 1024:.1f} MB")
+    print(f"media cache: {cache.stats()}")
+    print("requests to stand-in services:")
+    for service, count in sorted(stats.items()):
+        print(f"{count:8d}  {service}")
+
+
+if __name__ == "__main__":
+    main()
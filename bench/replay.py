@@ -0,0 +1,233 @@
+"""Update replay
+
+Replays recorded updates (see `extra.recorder`) into the dispatcher of the
+bot at a chosen rate or speed-up of the recorded timing. Network calls go to
+local stand-in services (see `bench.fakes`). Reports dispatcher backlog,
+dropped updates and latency of every handler, to try worker counts and queue
+limits before a deploy.
+
+Usage:
+    python -m bench.replay FILE [--rate N | --speed X] [--workers N]
+                                [--queue-limit N] [--send-delay S]
+                                [--latency SERVICE=MS] [--fail SERVICE=RATE]
+    python -m bench.replay FILE --anonymise OUTPUT
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import tempfile
+import threading
+import statistics
+
+from collections import defaultdict
+
+# stand-in services and bot environment
+from bench.fakes import pairs
+from bench.load import start_fakes, redirect, set_env, make_bot, percentiles
+
+
+def load(path: str) -> list[tuple[float | None, dict]]:
+    """Read recorded updates, raw update JSON lines are accepted too
+
+    Args:
+        path (str): file with one update per line
+
+    Returns:
+        list[tuple[float | None, dict]]: receive time and update
+    """
+    updates = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if not (line := line.strip()):
+                continue
+            data = json.loads(line)
+            if "update" in data:
+                updates.append((data.get("time", None), data["update"]))
+            else:
+                updates.append((None, data))
+    return updates
+
+
+def schedule(
+    updates: list[tuple[float | None, dict]],
+    rate: float = None,
+    speed: float = 1.0,
+) -> list[tuple[float, dict]]:
+    """Get offset from start of replay for every update
+
+    Args:
+        updates (list[tuple[float | None, dict]]): recorded updates
+        rate (float, optional): updates per second, recorded timing is used
+        if not set. Defaults to None.
+        speed (float, optional): speed-up of recorded timing. Defaults to 1.
+
+    Returns:
+        list[tuple[float, dict]]: offset in seconds and update
+    """
+    if rate or any(_time is None for _time, _ in updates):
+        rate = rate or 10.0
+        return [(i / rate, update) for i, (_, update) in enumerate(updates)]
+    first = updates[0][0] if updates else 0.0
+    return [((_time - first) / speed, update) for _time, update in updates]
+
+
+class Stats:
+    """Latency of every handler and dispatcher backlog"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # update id -> time it was put into update queue
+        self.enqueued: dict[int, float] = {}
+        # handler -> seconds spent in handler / since update was enqueued
+        self.handle = defaultdict(list)
+        self.total = defaultdict(list)
+        self.in_flight = 0
+        # update queue and worker queue sizes
+        self.backlog: list[tuple[int, int]] = []
+
+    def timed(self, name: str, callback):
+        """Wrap handler callback to measure its latency"""
+
+        def wrapper(update, context):
+            start = time.perf_counter()
+            with self.lock:
+                self.in_flight += 1
+            try:
+                return callback(update, context)
+            finally:
+                end = time.perf_counter()
+                with self.lock:
+                    self.in_flight -= 1
+                    self.handle[name].append(end - start)
+                    self.total[name].append(
+                        end - self.enqueued.get(update.update_id, start)
+                    )
+
+        return wrapper
+
+
+def anonymise_file(path: str, output: str) -> None:
+    """Write anonymised copy of recorded updates"""
+    from extra.recorder import anonymise
+
+    with open(output, "w", encoding="utf-8") as file:
+        for _time, update in load(path):
+            line = {"time": _time, "update": anonymise(update)}
+            file.write(json.dumps(line) + "\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("file", help="recorded updates")
+    parser.add_argument("--anonymise", metavar="OUTPUT", default=None)
+    parser.add_argument("--rate", type=float, default=None, help="updates/s")
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="speed-up of recording"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="dispatcher workers"
+    )
+    parser.add_argument(
+        "--queue-limit",
+        type=int,
+        default=0,
+        help="drop updates, when backlog is this long, 0 for no limit",
+    )
+    parser.add_argument(
+        "--send-delay", type=float, default=0.0, help="SEND_DELAY of the bot"
+    )
+    parser.add_argument("--latency", type=pairs, action="append", default=[])
+    parser.add_argument("--fail", type=pairs, action="append", default=[])
+    parser.add_argument("--video-size", type=int, default=2 << 20)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.anonymise:
+        return anonymise_file(args.file, args.anonymise)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    if not (plan := schedule(load(args.file), args.rate, args.speed)):
+        return print("No updates.")
+
+    fakes, port = start_fakes(args)
+    directory = tempfile.TemporaryDirectory()
+    try:
+        set_env(directory.name)
+        os.environ["SEND_DELAY"] = str(args.send_delay)
+        redirect(port)
+
+        import main as bot
+
+        from telegram import Update
+        from telegram.ext import Updater
+
+        tg = make_bot(port, args.workers + 4)
+        dispatcher = Updater(bot=tg, workers=args.workers).dispatcher
+        bot.add_handlers(dispatcher)
+        stats = Stats()
+        for handlers in dispatcher.handlers.values():
+            for handler in handlers:
+                name = handler.callback.__name__
+                handler.callback = stats.timed(name, handler.callback)
+        updates = dispatcher.update_queue
+        workers = dispatcher._Dispatcher__async_queue
+        threading.Thread(target=dispatcher.start, daemon=True).start()
+
+        def sample(stop: threading.Event) -> None:
+            while not stop.wait(0.1):
+                stats.backlog.append((updates.qsize(), workers.qsize()))
+
+        stop = threading.Event()
+        threading.Thread(target=sample, args=(stop,), daemon=True).start()
+
+        # feed updates on schedule
+        dropped, start = 0, time.perf_counter()
+        for offset, data in plan:
+            if (wait := start + offset - time.perf_counter()) > 0:
+                time.sleep(wait)
+            if args.queue_limit and (
+                updates.qsize() + workers.qsize() >= args.queue_limit
+            ):
+                dropped += 1
+                continue
+            update = Update.de_json(data, tg)
+            stats.enqueued[update.update_id] = time.perf_counter()
+            updates.put(update)
+        fed = time.perf_counter() - start
+
+        # wait for backlog to drain
+        idle = 0
+        while idle < 3:
+            time.sleep(0.1)
+            busy = updates.qsize() or workers.qsize() or stats.in_flight
+            idle = 0 if busy else idle + 1
+        wall = time.perf_counter() - start
+        stop.set()
+        dispatcher.stop()
+    finally:
+        fakes.terminate()
+        directory.cleanup()
+
+    total = len(plan)
+    print(f"updates:     {total} in {fed:.2f} s ({total / fed:.1f} upd/s)")
+    print(f"dropped:     {dropped} ({dropped / (total or 1):.1%})")
+    print(f"workers:     {args.workers}")
+    print(f"wall time:   {wall:.2f} s ({(total - dropped) / wall:.1f} upd/s)")
+    if stats.backlog:
+        for i, name in enumerate(("update queue", "worker queue")):
+            sizes = [sample[i] for sample in stats.backlog]
+            print(
+                f"{name}: max {max(sizes)}, "
+                f"mean {statistics.mean(sizes):.1f}"
+            )
+    print("latency per handler (in handler / since enqueued):")
+    for name in sorted(stats.handle):
+        print(f"{name} ({len(stats.handle[name])})")
+        print(f"  handler: {percentiles(stats.handle[name])}")
+        print(f"  total:   {percentiles(stats.total[name])}")
+
+
+if __name__ == "__main__":
+    main()
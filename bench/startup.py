@@ -0,0 +1,141 @@
+"""Startup benchmark
+
+Runs the bot module in a fresh interpreter with `-X importtime` and reports
+import time, the slowest imports and time to the first response (answer to
+inline query with pixiv link, which needs no network).
+
+Usage:
+    python -m bench.startup [--runs N] [--top N]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+from pathlib import Path
+
+# repository root
+root = Path(__file__).parent.parent
+
+# answer first update in child process
+child = """
+import time
+from types import SimpleNamespace
+
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+from telegram import Update, Bot
+
+bot = Bot("123456:benchmark")
+update = Update.de_json(
+    {
+        "update_id": 1,
+        "inline_query": {
+            "id": "1",
+            "from": {"id": 1, "is_bot": False, "first_name": "Bench"},
+            "query": "https://www.pixiv.net/artworks/1",
+            "offset": "",
+        },
+    },
+    bot,
+)
+answers = []
+context = SimpleNamespace(
+    bot=SimpleNamespace(answer_inline_query=lambda *args: answers.append(args))
+)
+main.inliner(update, context)
+assert answers, "no answer"
+print("ready", imported - start, time.perf_counter() - start, flush=True)
+"""
+
+
+def get_env() -> dict:
+    """Environment for child process, no real services needed"""
+    env = os.environ.copy()
+    env.setdefault("DATABASE_URL", "sqlite://")
+    env.setdefault("PATH_SETTINGS", str(root / "settings.toml"))
+    env.setdefault("TOKEN", "123456:benchmark")
+    return env
+
+
+def parse_importtime(stderr: str) -> list[tuple[int, int, str]]:
+    """Parse `-X importtime` output
+
+    Args:
+        stderr (str): child stderr
+
+    Returns:
+        list[tuple[int, int, str]]: self time (us), cumulative time (us) and
+        name of every imported module
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _self, cumulative, name = line[len("import time:") :].split("|")
+        # name is indented by two spaces per nesting level
+        imports.append((int(_self), int(cumulative), name[1:].rstrip()))
+    return imports
+
+
+def run() -> tuple[float, float, float, list[tuple[int, int, str]]]:
+    """Start bot module once
+
+    Returns:
+        tuple: import time, first response time (both measured inside the
+        child), wall time from spawn to first response and import list
+    """
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", child],
+        cwd=root,
+        env=get_env(),
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode:
+        raise RuntimeError(proc.stderr[-2000:])
+    line = next(
+        line for line in proc.stdout.splitlines() if line.startswith("ready")
+    )
+    _, imported, responded = line.split()
+    return (
+        float(imported),
+        float(responded),
+        wall,
+        parse_importtime(proc.stderr),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=5, help="number of runs")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports")
+    args = parser.parse_args()
+
+    results = [run() for _ in range(args.runs)]
+    imported = [result[0] for result in results]
+    responded = [result[1] for result in results]
+    wall = [result[2] for result in results]
+
+    print(f"runs: {args.runs}")
+    print(f"import main:     median {statistics.median(imported):.3f} s")
+    print(f"first response:  median {statistics.median(responded):.3f} s")
+    print(f"spawn to answer: median {statistics.median(wall):.3f} s")
+    print("\nslowest imports of first two levels (last run, cumulative):")
+    top = sorted(
+        (imp for imp in results[-1][3] if not imp[2].startswith("    ")),
+        key=lambda imp: imp[1],
+        reverse=True,
+    )
+    for _, cumulative, name in top[: args.top]:
+        print(f"{cumulative / 1000:10.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,10 @@
     String,
     Boolean,
     Integer,
+    Text,
+    Float,
+    DateTime,
+    func,
 )
 from sqlalchemy.orm import declarative_base, validates
 
@@ -48,3 +52,51 @@ def validate_twitter_style(self, key, value):
     in_orig = Column(Boolean, default=False, nullable=False)
     # include link of media
     include_link = Column(Boolean, default=False, nullable=False)
+
+
+class Job(Base):
+    __tablename__ = "job"
+
+    # job id
+    id = Column(BigInteger, primary_key=True)
+    # job kind
+    kind = Column(String, nullable=False)
+    # job payload (json)
+    payload = Column(Text, nullable=False)
+    # job status: queued, running or failed
+    status = Column(String, default="queued", nullable=False, index=True)
+    # number of times job was claimed
+    attempts = Column(Integer, default=0, nullable=False)
+    # time of creation
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    # time of last claim
+    claimed_at = Column(DateTime)
+
+
+class Analytics(Base):
+    __tablename__ = "analytics"
+
+    # record id (sqlite autoincrements only integer keys)
+    id = Column(
+        BigInteger().with_variant(Integer, "sqlite"),
+        primary_key=True,
+    )
+    # time of processing
+    created_at = Column(DateTime, nullable=False, index=True)
+    # chat id
+    chat_id = Column(BigInteger)
+    # link type
+    link_type = Column(Integer, nullable=False)
+    # provider which returned media
+    provider = Column(String)
+    # stage timings in seconds
+    resolve_time = Column(Float, nullable=False)
+    download_time = Column(Float, nullable=False)
+    convert_time = Column(Float, nullable=False)
+    upload_time = Column(Float, nullable=False)
+    total_time = Column(Float, nullable=False)
+    # downloaded and uploaded bytes
+    bytes_in = Column(BigInteger, nullable=False)
+    bytes_out = Column(BigInteger, nullable=False)
+    # outcome: ok, error, not_found or too_big
+    outcome = Column(String, nullable=False)
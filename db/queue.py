@@ -0,0 +1,138 @@
+"""Job queue module"""
+import os
+import logging
+
+from datetime import timedelta
+
+# working with database
+from sqlalchemy import select, update, delete, or_, and_, func
+from sqlalchemy.orm import Session
+
+# import engine
+from db import engine
+
+# import job model
+from db.models import Job
+
+# get logger
+log = logging.getLogger("yoiyoi.db.queue")
+
+# seconds after which running job can be claimed again
+JOB_TIMEOUT = int(os.environ.get("JOB_TIMEOUT", "600"))
+
+# max number of claims per job
+JOB_ATTEMPTS = 3
+
+# seconds before failed job can be claimed again
+JOB_RETRY_DELAY = int(os.environ.get("JOB_RETRY_DELAY", "60"))
+
+
+def enqueue(kind: str, payload: str) -> int:
+    """Add job to queue
+
+    Args:
+        kind (str): job kind
+        payload (str): job payload in json
+
+    Returns:
+        int: job id
+    """
+    with Session(engine) as s:
+        s.add(job := Job(kind=kind, payload=payload))
+        s.commit()
+        log.debug("Enqueued %s job #%d.", kind, job.id)
+        return job.id
+
+
+def claim() -> Job | None:
+    """Claim the oldest available job
+
+    Queued jobs, failed more than `JOB_RETRY_DELAY` seconds ago, and running
+    jobs claimed more than `JOB_TIMEOUT` seconds ago are available. Rows
+    locked by other workers are skipped. Stale running jobs without attempts
+    left are marked as failed.
+
+    Returns:
+        Job | None: claimed job
+    """
+    timeout = func.now() - timedelta(seconds=JOB_TIMEOUT)
+    retry = func.now() - timedelta(seconds=JOB_RETRY_DELAY)
+    with Session(engine) as s:
+        s.expire_on_commit = False
+        # workers crashed on the last attempt
+        if failed := s.execute(
+            update(Job)
+            .where(
+                Job.status == "running",
+                Job.claimed_at < timeout,
+                Job.attempts >= JOB_ATTEMPTS,
+            )
+            .values(status="failed")
+        ).rowcount:
+            s.commit()
+            log.warning("Marked %d stale jobs as failed.", failed)
+        job = s.scalars(
+            select(Job)
+            .where(
+                or_(
+                    and_(
+                        Job.status == "queued",
+                        or_(Job.claimed_at.is_(None), Job.claimed_at < retry),
+                    ),
+                    and_(Job.status == "running", Job.claimed_at < timeout),
+                ),
+                Job.attempts < JOB_ATTEMPTS,
+            )
+            .order_by(Job.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).first()
+        if not job:
+            return None
+        job.status = "running"
+        job.attempts += 1
+        job.claimed_at = func.now()
+        s.commit()
+        log.debug(
+            "Claimed %s job #%d (%d try).", job.kind, job.id, job.attempts
+        )
+        return job
+
+
+def finish(job: Job, ok: bool = True, payload: str | None = None) -> None:
+    """Remove finished job or return failed one to queue after a delay
+
+    Args:
+        job (Job): claimed job
+        ok (bool, optional): whether job succeeded. Defaults to True.
+        payload (str | None, optional): what is left to do of failed job.
+        Defaults to None.
+    """
+    with Session(engine) as s:
+        if ok:
+            s.execute(delete(Job).where(Job.id == job.id))
+        else:
+            s.execute(
+                update(Job)
+                .where(Job.id == job.id)
+                .values(
+                    status=(
+                        "queued" if job.attempts < JOB_ATTEMPTS else "failed"
+                    ),
+                    payload=payload or job.payload,
+                    claimed_at=func.now(),
+                )
+            )
+        s.commit()
+
+
+def pending() -> int:
+    """Count queued jobs
+
+    Returns:
+        int: number of queued jobs
+    """
+    with Session(engine) as s:
+        return s.scalar(
+            select(func.count()).select_from(Job).where(Job.status == "queued")
+        )
@@ -65,6 +65,7 @@ def validate(cls, value: int):
         """,
         "link": "https://twitter.com/{author}/status/{id}",
         "full": "https://pbs.twimg.com/media/{id}?format={format}&name=orig",
+        "variant": "https://pbs.twimg.com/media/{id}?format=jpg&name={name}",
         "type": LinkType.TWITTER,
     },
     "pixiv": {
@@ -0,0 +1,213 @@
+"""Analytics module"""
+import os
+import time
+import logging
+import threading
+
+from datetime import datetime
+from functools import wraps
+from contextlib import contextmanager
+
+# import metrics
+from extra import metrics
+
+# get logger
+log = logging.getLogger("yoiyoi.extra.analytics")
+
+# seconds between flushes to database
+ANALYTICS_INTERVAL = int(os.environ.get("ANALYTICS_INTERVAL", "30"))
+
+# max number of buffered records
+ANALYTICS_BUFFER = 10000
+
+# stages counted in columns of other stages
+_columns = {"ffmpeg": "convert"}
+
+# record of current thread
+_local = threading.local()
+
+# records waiting to be flushed
+_buffer: list[dict] = []
+_lock = threading.Lock()
+
+
+def current() -> dict | None:
+    """Get record of current thread"""
+    return getattr(_local, "record", None)
+
+
+@contextmanager
+def track(chat_id: int, link_type: int):
+    """Collect analytics record for processed link
+
+    Args:
+        chat_id (int): chat id
+        link_type (int): link type
+    """
+    record = {
+        "created_at": datetime.utcnow(),
+        "chat_id": chat_id,
+        "link_type": link_type,
+        "provider": None,
+        "resolve_time": 0.0,
+        "download_time": 0.0,
+        "convert_time": 0.0,
+        "upload_time": 0.0,
+        "total_time": 0.0,
+        "bytes_in": 0,
+        "bytes_out": 0,
+        "outcome": None,
+    }
+    prev, _local.record = current(), record
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception:
+        record["outcome"] = "error"
+        raise
+    finally:
+        record["total_time"] = time.perf_counter() - start
+        record["outcome"] = record["outcome"] or "ok"
+        _local.record = prev
+        metrics.count(record)
+        with _lock:
+            # forget the oldest record
+            if len(_buffer) >= ANALYTICS_BUFFER:
+                _buffer.pop(0)
+            _buffer.append(record)
+
+
+@contextmanager
+def bind(record: dict | None):
+    """Collect stages of link from another thread into its record
+
+    Args:
+        record (dict | None): analytics record
+    """
+    prev, _local.record = current(), record
+    try:
+        yield
+    finally:
+        _local.record = prev
+
+
+@contextmanager
+def stage(name: str):
+    """Measure time of stage: resolve, probe, download, convert, ffmpeg, upload
+
+    Nested stages (probe) are only observed by metrics.
+
+    Args:
+        name (str): stage name
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start)
+
+
+def add_time(name: str, seconds: float) -> None:
+    """Add time of stage, which is measured elsewhere, e.g. shared by links
+
+    Args:
+        name (str): stage name
+        seconds (float): time spent
+    """
+    metrics.observe(name, seconds, record := current())
+    column = f"{_columns.get(name, name)}_time"
+    if record is not None and column in record:
+        record[column] += seconds
+
+
+def timed(name: str):
+    """Measure time of every function call as stage
+
+    Args:
+        name (str): stage name
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def provider(name: str) -> None:
+    """Set provider which returned media
+
+    Args:
+        name (str): provider name
+    """
+    if (record := current()) is not None:
+        record["provider"] = name
+
+
+def add_bytes(bytes_in: int = 0, bytes_out: int = 0) -> None:
+    """Count downloaded and uploaded bytes
+
+    Args:
+        bytes_in (int, optional): downloaded bytes. Defaults to 0.
+        bytes_out (int, optional): uploaded bytes. Defaults to 0.
+    """
+    metrics.add_bytes(record := current(), bytes_in, bytes_out)
+    if record is not None:
+        record["bytes_in"] += bytes_in
+        record["bytes_out"] += bytes_out
+
+
+def outcome(value: str) -> None:
+    """Set outcome of processed link
+
+    Args:
+        value (str): outcome, e.g. "not_found" or "too_big"
+    """
+    if (record := current()) is not None:
+        record["outcome"] = value
+
+
+def flush() -> None:
+    """Insert buffered records into database"""
+    # import here, so extractors don't need database
+    from sqlalchemy import insert
+
+    from db import engine
+    from db.models import Analytics
+
+    with _lock:
+        if not _buffer:
+            return
+        rows = _buffer.copy()
+        _buffer.clear()
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert(Analytics), rows)
+        log.debug("Flushed %d analytics records.", len(rows))
+    except Exception as ex:
+        log.error("Exception occured: %s.", ex)
+        # put records back, keep the newest ones
+        with _lock:
+            if (room := ANALYTICS_BUFFER - len(_buffer)) > 0:
+                _buffer[:0] = rows[-room:]
+
+
+def start() -> threading.Thread:
+    """Start flushing records in background
+
+    Returns:
+        threading.Thread: flushing thread
+    """
+
+    def loop():
+        while True:
+            time.sleep(ANALYTICS_INTERVAL)
+            flush()
+
+    thread = threading.Thread(target=loop, name="analytics", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,139 @@
+"""Memory budget module
+
+Downloads and conversions reserve bytes from a global budget before media
+is read into memory. Bytes reserved while processing a link are released
+after it is sent.
+"""
+import os
+import logging
+import threading
+
+from contextlib import contextmanager
+
+# import metrics
+from extra import metrics
+
+# get logger
+log = logging.getLogger("yoiyoi.extra.budget")
+
+# bytes of media, which can be held in memory at once
+MEDIA_BUDGET = int(os.environ.get("MEDIA_BUDGET", str(128 << 20)))
+
+# seconds to wait for more bytes, when link already holds some
+BUDGET_WAIT = int(os.environ.get("BUDGET_WAIT", "30"))
+
+
+class Budget:
+    """Byte-budget semaphore"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.reserved = 0
+        self.peak = 0
+        self.cond = threading.Condition()
+
+    def reserve(self, size: int, timeout: float = None) -> bool:
+        """Reserve bytes, wait while they don't fit
+
+        Bytes are reserved anyway, when waiting timed out. Anything bigger
+        than the whole budget reserves the whole budget.
+
+        Args:
+            size (int): number of bytes
+            timeout (float, optional): seconds to wait. Defaults to None.
+
+        Returns:
+            bool: True, if bytes fit into budget
+        """
+        with self.cond:
+            fits = self.cond.wait_for(
+                lambda: self.reserved + size <= self.limit, timeout
+            )
+            self.reserved += size
+            self.peak = max(self.peak, self.reserved)
+        return fits
+
+    def release(self, size: int) -> None:
+        """Release reserved bytes
+
+        Args:
+            size (int): number of bytes
+        """
+        with self.cond:
+            self.reserved -= size
+            self.cond.notify_all()
+
+
+budget = Budget(MEDIA_BUDGET)
+metrics.watch_budget("limit", lambda: budget.limit)
+metrics.watch_budget("reserved", lambda: budget.reserved)
+metrics.watch_budget("peak", lambda: budget.peak)
+
+
+class Scope:
+    """Bytes held by link, reserved from one or more threads"""
+
+    def __init__(self):
+        self.held = 0
+        self.closed = False
+
+
+# scope of link of current thread
+_local = threading.local()
+
+
+def current() -> Scope | None:
+    """Get scope of current thread"""
+    return getattr(_local, "scope", None)
+
+
+@contextmanager
+def scope():
+    """Release bytes reserved while processing link"""
+    prev, _local.scope = current(), Scope()
+    try:
+        yield _local.scope
+    finally:
+        link_scope, _local.scope = _local.scope, prev
+        with budget.cond:
+            held, link_scope.held, link_scope.closed = link_scope.held, 0, True
+        if held:
+            budget.release(held)
+
+
+@contextmanager
+def bind(link_scope: Scope | None):
+    """Reserve bytes for link of another thread
+
+    Args:
+        link_scope (Scope | None): scope of link
+    """
+    prev, _local.scope = current(), link_scope
+    try:
+        yield
+    finally:
+        _local.scope = prev
+
+
+def reserve(size: int) -> None:
+    """Reserve bytes for link of current thread, before reading media
+
+    The first reservation of link waits for room as long as needed. Later
+    ones wait `BUDGET_WAIT` seconds at most, so links, which hold bytes,
+    can't block each other forever.
+
+    Args:
+        size (int): number of bytes
+    """
+    link_scope = current()
+    if link_scope is None or link_scope.closed or size <= 0:
+        return
+    size = min(size, budget.limit)
+    if not budget.reserve(size, BUDGET_WAIT if link_scope.held else None):
+        log.warning("Memory budget is exceeded: %d bytes.", budget.reserved)
+    with budget.cond:
+        # link is done meanwhile, nothing would release these bytes
+        if link_scope.closed:
+            budget.release(size)
+        else:
+            link_scope.held += size
@@ -0,0 +1,278 @@
+"""Cache module
+
+Downloaded media is kept on disk, so the same link isn't downloaded again
+while it is fresh by `Cache-Control` or `Expires`. Stale copies with `ETag`
+or `Last-Modified` are revalidated with conditional requests. The least
+recently used files are evicted, when cache is over `CACHE_SIZE`.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+
+from pathlib import Path
+from collections import Counter, OrderedDict
+from email.utils import parsedate_to_datetime
+
+# import metrics
+from extra import metrics
+
+# get logger
+log = logging.getLogger("yoiyoi.extra.cache")
+
+# cache location
+CACHE_DIR = Path(
+    os.environ.get("CACHE_DIR", "")
+    or Path(tempfile.gettempdir()) / "yoiyoi-cache"
+)
+
+# max bytes of cached files, 0 to disable cache
+CACHE_SIZE = int(os.environ.get("CACHE_SIZE", str(256 << 20)))
+
+# seconds after which unfinished writes are surely left by crashes
+LEFTOVER_AGE = 600
+
+
+def parse_date(value: str | None) -> float | None:
+    """Parse http date into timestamp, None if invalid"""
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def freshness(headers) -> float | None:
+    """Get seconds response stays fresh
+
+    Args:
+        headers (CaseInsensitiveDict): response headers
+
+    Returns:
+        float | None: seconds, None if response can't be cached
+    """
+    directives = {
+        key.strip().lower(): value.strip('" ')
+        for key, _, value in (
+            item.partition("=")
+            for item in headers.get("Cache-Control", "").split(",")
+        )
+    }
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        age = 0.0
+    elif "max-age" in directives:
+        try:
+            age = float(directives["max-age"])
+        except ValueError:
+            age = 0.0
+    elif expires := parse_date(headers.get("Expires")):
+        age = expires - (parse_date(headers.get("Date")) or time.time())
+    else:
+        age = 0.0
+    age -= float(headers.get("Age", "0") or 0)
+    # stale copy is only useful, if it can be revalidated
+    if age <= 0 and not ("ETag" in headers or "Last-Modified" in headers):
+        return None
+    return max(age, 0.0)
+
+
+class Cache:
+    """Size-capped LRU cache of media files"""
+
+    def __init__(self, directory: Path, limit: int):
+        self.directory, self.limit = directory, limit
+        # key -> size, the least recently used first
+        self.index: OrderedDict[str, int] = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.loaded = False
+        # result -> number of downloads, bytes served from cache
+        self.counts: Counter[str] = Counter()
+        self.saved = 0
+
+    def load(self) -> None:
+        """Index cached files, the least recently used first, and remove
+        leftovers of interrupted writes"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        files = sorted(
+            self.directory.glob("*.json"), key=lambda f: f.stat().st_mtime
+        )
+        for file in files:
+            try:
+                size = json.loads(file.read_text())["size"]
+            except (OSError, ValueError, KeyError):
+                file.unlink(missing_ok=True)
+                continue
+            if not (self.directory / file.stem).is_file():
+                file.unlink(missing_ok=True)
+                continue
+            self.index[file.stem] = size
+            self.size += size
+        # temporary files and content without metadata
+        old = time.time() - LEFTOVER_AGE
+        for file in self.directory.iterdir():
+            if file.suffix not in {"", ".tmp"} or file.name in self.index:
+                continue
+            try:
+                if file.stat().st_mtime < old:
+                    log.info("Removing leftover cache file: %r.", file.name)
+                    file.unlink()
+            except OSError:
+                pass
+        self.loaded = True
+        log.info(
+            "Loaded %d cached files: %d bytes.", len(self.index), self.size
+        )
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def lookup(self, url: str) -> dict | None:
+        """Get cached copy of link
+
+        Args:
+            url (str): media link
+
+        Returns:
+            dict | None: metadata with `fresh` set, None if not cached
+        """
+        if not self.limit:
+            return None
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            if (key := self.key(url)) not in self.index:
+                return None
+        try:
+            meta = json.loads((self.directory / f"{key}.json").read_text())
+        except (OSError, ValueError):
+            return None
+        meta["fresh"] = time.time() < meta["expires"]
+        return meta
+
+    @staticmethod
+    def validators(meta: dict | None) -> dict:
+        """Get headers of conditional request for cached copy"""
+        headers = {}
+        if meta and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def read(self, meta: dict, result: str, headers=None) -> bytes | None:
+        """Read cached copy, counting it as hit
+
+        Args:
+            meta (dict): metadata from lookup
+            result (str): "hit" or "revalidated"
+            headers (CaseInsensitiveDict, optional): headers of not
+            modified response, which extend freshness. Defaults to None.
+
+        Returns:
+            bytes | None: content, None if file is gone
+        """
+        key = meta["key"]
+        try:
+            content = (self.directory / key).read_bytes()
+        except OSError:
+            return self.forget(key)
+        if headers is not None and (age := freshness(headers)) is not None:
+            meta["expires"] = time.time() + age
+            meta["etag"] = headers.get("ETag", meta.get("etag"))
+        meta.pop("fresh", None)
+        # used just now
+        self.write_meta(key, meta)
+        with self.lock:
+            if key in self.index:
+                self.index.move_to_end(key)
+        self.count(result, len(content))
+        return content
+
+    def count(self, result: str, saved: int = 0) -> None:
+        """Count download by cache result
+
+        Args:
+            result (str): "hit", "revalidated" or "miss"
+            saved (int, optional): bytes served from cache. Defaults to 0.
+        """
+        with self.lock:
+            self.counts[result] += 1
+            self.saved += saved
+        metrics.count_cache(result, saved)
+
+    def stats(self) -> str:
+        """Get hit ratio and bytes saved"""
+        with self.lock:
+            total = sum(self.counts.values())
+            hits = total - self.counts["miss"]
+            return (
+                f"{hits}/{total} hits ({hits / (total or 1):.0%}), "
+                f"{self.counts['revalidated']} revalidated, "
+                f"{self.saved} bytes saved"
+            )
+
+    def store(self, url: str, headers, content: bytes) -> None:
+        """Cache downloaded content, if response allows it
+
+        Args:
+            url (str): media link
+            headers (CaseInsensitiveDict): response headers
+            content (bytes): media content
+        """
+        self.count("miss")
+        if not self.limit or len(content) > self.limit // 4:
+            return
+        if (age := freshness(headers)) is None:
+            return
+        key = self.key(url)
+        meta = {
+            "key": key,
+            "url": url,
+            "size": len(content),
+            "expires": time.time() + age,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+        }
+        try:
+            tmp = self.directory / f"{key}.{threading.get_ident()}.tmp"
+            tmp.write_bytes(content)
+            os.replace(tmp, self.directory / key)
+            self.write_meta(key, meta)
+        except OSError as ex:
+            log.warning("Couldn't cache %r: %s.", url, ex)
+            return
+        with self.lock:
+            self.size += len(content) - self.index.pop(key, 0)
+            self.index[key] = len(content)
+            evicted = []
+            while self.size > self.limit:
+                old, size = self.index.popitem(last=False)
+                self.size -= size
+                evicted.append(old)
+        for old in evicted:
+            self.remove(old)
+
+    def write_meta(self, key: str, meta: dict) -> None:
+        tmp = self.directory / f"{key}.{threading.get_ident()}.json.tmp"
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, self.directory / f"{key}.json")
+
+    def remove(self, key: str) -> None:
+        (self.directory / f"{key}.json").unlink(missing_ok=True)
+        (self.directory / key).unlink(missing_ok=True)
+
+    def forget(self, key: str) -> None:
+        """Drop entry, which files are gone"""
+        with self.lock:
+            self.size -= self.index.pop(key, 0)
+        self.remove(key)
+
+
+cache = Cache(CACHE_DIR, CACHE_SIZE)
+metrics.watch_cache(lambda: cache.size)
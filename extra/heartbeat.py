@@ -0,0 +1,79 @@
+"""Heartbeat module
+
+Chat actions ("uploading photo...") are shown by Telegram for 5 seconds
+only. Every chat gets one background thread, which repeats the latest
+action every `ACTION_INTERVAL` seconds, while any link of the chat is being
+sent, so senders don't wait for extra Bot API calls.
+"""
+import os
+import logging
+import threading
+
+from contextlib import contextmanager
+
+from telegram import Bot
+
+# get logger
+log = logging.getLogger("yoiyoi.extra.heartbeat")
+
+# seconds between repeated chat actions
+ACTION_INTERVAL = float(os.environ.get("ACTION_INTERVAL", "4"))
+
+# chat id -> running heartbeat
+_beats: dict[int, "Heartbeat"] = {}
+_lock = threading.Lock()
+
+
+class Heartbeat(threading.Thread):
+    """Thread, which repeats chat action, until it is stopped"""
+
+    def __init__(self, bot: Bot, chat_id: int):
+        super().__init__(name=f"heartbeat-{chat_id}", daemon=True)
+        self.bot, self.chat_id = bot, chat_id
+        # actions of senders, the latest one is shown
+        self.actions: list[str] = []
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while True:
+            with _lock:
+                if not self.actions:
+                    return
+                action = self.actions[-1]
+            try:
+                self.bot.send_chat_action(self.chat_id, action)
+            except Exception as ex:
+                log.debug("Couldn't send chat action: %s.", ex)
+            if self.stopped.wait(ACTION_INTERVAL):
+                return
+
+
+@contextmanager
+def action(bot: Bot, chat_id: int, chat_action: str, enable: bool = True):
+    """Show chat action, while block is running
+
+    Args:
+        bot (Bot): telegram bot
+        chat_id (int): chat id
+        chat_action (str): chat action, e.g. `ChatAction.UPLOAD_VIDEO`
+        enable (bool, optional): show action. Defaults to True.
+    """
+    if not enable:
+        yield
+        return
+    with _lock:
+        if new := chat_id not in _beats:
+            _beats[chat_id] = Heartbeat(bot, chat_id)
+        beat = _beats[chat_id]
+        beat.actions.append(chat_action)
+        if new:
+            beat.start()
+    try:
+        yield
+    finally:
+        with _lock:
+            beat.actions.remove(chat_action)
+            if not beat.actions:
+                beat.stopped.set()
+                if _beats.get(chat_id) is beat:
+                    del _beats[chat_id]
@@ -1,5 +1,20 @@
 """Helper module"""
-import requests
+import os
+import time
+import logging
+import threading
+
+# import analytics
+from extra import analytics
+
+# get logger
+log = logging.getLogger("yoiyoi.extra.helper")
+
+# max image side length
+IM_MAX = (2560, 2560)
+
+# shrinked max image side length
+IM_SHR = (2240, 2240)
 
 # fake headers
 fake_headers = {
@@ -10,7 +25,8 @@
 }
 
 
-def get_file_size(link: str, session: requests.Session = None) -> int:
+@analytics.timed("probe")
+def get_file_size(link: str, session: "requests.Session" = None) -> int:
     """Gets file size
 
     Args:
@@ -20,6 +36,9 @@ def get_file_size(link: str, session: requests.Session = None) -> int:
         int: size of file
     """
     if not session:
+        # http requests, imported on first use to keep start fast
+        import requests
+
         session = requests
     if link:
         r = session.head(
@@ -30,3 +49,97 @@ def get_file_size(link: str, session: requests.Session = None) -> int:
         if r.ok and (size := r.headers.get("Content-Length", None)):
             return int(size)
     return 0
+
+
+################################################################################
+# provider sessions
+################################################################################
+
+# seconds to keep warmed session, if its cookies don't expire earlier
+SESSION_TTL = int(os.environ.get("SESSION_TTL", "1800"))
+
+# seconds before expiration to refresh session in background
+SESSION_REFRESH = int(os.environ.get("SESSION_REFRESH", "300"))
+
+# home page -> (session, expiration time)
+_sessions: dict[str, tuple["requests.Session", float]] = {}
+_refreshing: set[str] = set()
+_sessions_lock = threading.Lock()
+
+
+def warm_session(base: str) -> "requests.Session":
+    """Get cookies from provider's home page into new session
+
+    Args:
+        base (str): home page
+
+    Returns:
+        requests.Session: warmed session
+    """
+    # http requests
+    import requests
+
+    s = requests.session()
+    with analytics.stage("warm"):
+        s.get(url=base, headers=fake_headers, timeout=10)
+    log.debug("Warmed session of %r: %r.", base, s.cookies.get_dict())
+    expires = [c.expires for c in s.cookies if c.expires]
+    with _sessions_lock:
+        _sessions[base] = s, min([time.time() + SESSION_TTL, *expires])
+    return s
+
+
+def refresh_session(base: str) -> None:
+    """Warm session again, keeping the old one on failure
+
+    Args:
+        base (str): home page
+    """
+    try:
+        warm_session(base)
+    except Exception as ex:
+        log.warning("Couldn't refresh session of %r: %s.", base, ex)
+    finally:
+        with _sessions_lock:
+            _refreshing.discard(base)
+
+
+def get_session(base: str) -> "requests.Session":
+    """Get session with cookies of provider's home page
+
+    Session is warmed on the first call, then reused until its cookies
+    expire. Shortly before that it is refreshed in background, so callers
+    don't wait for the home page.
+
+    Args:
+        base (str): home page
+
+    Returns:
+        requests.Session: warmed session
+    """
+    with _sessions_lock:
+        s, expires = _sessions.get(base, (None, 0))
+        left = expires - time.time()
+        refresh = 0 < left < SESSION_REFRESH and base not in _refreshing
+        if refresh:
+            _refreshing.add(base)
+    if left <= 0:
+        return warm_session(base)
+    if refresh:
+        threading.Thread(
+            target=refresh_session,
+            args=(base,),
+            name="session-refresh",
+            daemon=True,
+        ).start()
+    return s
+
+
+def drop_session(base: str) -> None:
+    """Forget session, which provider doesn't accept anymore
+
+    Args:
+        base (str): home page
+    """
+    with _sessions_lock:
+        _sessions.pop(base, None)
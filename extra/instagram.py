@@ -6,8 +6,11 @@
 # http requests
 import requests
 
-# import fake headers
-from extra.helper import fake_headers
+# import analytics
+from extra import analytics
+
+# import fake headers & provider sessions
+from extra.helper import fake_headers, get_session, drop_session
 
 # import InstaMedia
 from extra.namedtuples import InstaMedia
@@ -68,15 +71,15 @@ def get_instadownloader_links(link: str) -> list[InstaMedia]:
                     )
         except json.decoder.JSONDecodeError as ex:
             log.error("Exception occured: %r.", ex)
+    if results:
+        analytics.provider("instadownloader")
     return results
 
 
 def get_instagramdownloads_links(link: str) -> list[InstaMedia]:
     base = "https://instagramdownloads.com/"
     api = f"{base}api/post"
-    s = requests.session()
-    s.get(url=base, headers=fake_headers)
-    log.debug(s.cookies.get_dict())
+    s = get_session(base)
     # get response
     tries, response, results = 1, None, []
     while tries <= MAX_TRIES:
@@ -101,6 +104,9 @@ def get_instagramdownloads_links(link: str) -> list[InstaMedia]:
             time.sleep(TIMEOUT)
         finally:
             tries += 1
+    # cookies may be stale, warm again next time
+    if response is not None and not response.ok:
+        drop_session(base)
     if response:
         log.debug("Response: %r.", response.content)
         try:
@@ -131,6 +137,8 @@ def get_instagramdownloads_links(link: str) -> list[InstaMedia]:
                     )
         except json.decoder.JSONDecodeError as ex:
             log.error("Exception occured: %r.", ex)
+    if results:
+        analytics.provider("instagramdownloads")
     return results
 
 
@@ -177,9 +185,12 @@ def get_sssgram_links(link: str) -> list[InstaMedia]:
                 )
         except json.decoder.JSONDecodeError as ex:
             log.error("Exception occured: %r.", ex)
+    if results:
+        analytics.provider("sssgram")
     return results
 
 
+@analytics.timed("resolve")
 def get_instagram_links(link: str) -> list[InstaMedia]:
     """Gets links for media provided by link
 
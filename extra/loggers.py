@@ -1,15 +1,22 @@
-"""Loggers module"""
+"""Loggers module
+
+Records are put into a queue by the calling thread and written to console
+and file by a single listener thread. Log file is rotated by size or time,
+rotated segments are compressed. Repetitive INFO lines are rate-limited.
+"""
 import os
+import gzip
+import time
+import queue
+import shutil
+import atexit
 import logging
+import threading
 
 from pathlib import Path
 from datetime import datetime
-
-# working with env
-from dotenv import load_dotenv
-
-# reading setings
-import tomli
+from functools import cache
+from logging.handlers import BaseRotatingHandler, QueueHandler, QueueListener
 
 # current timestamp & this file directory
 date_run = datetime.now()
@@ -19,23 +26,138 @@
 # logger
 ################################################################################
 
-# load .env file & get config
-load_dotenv()
-config = tomli.load(Path(os.getenv("PATH_SETTINGS")).open("rb"))
-
-# set basic config to logger
-logging.basicConfig(
-    format=config["log"]["form"],
-    level=config["log"]["level"],
-)
-
 # get root logger
 root_log = logging.getLogger()
 
+# file handler, created by setup()
+file_handler: "SegmentFileHandler | None" = None
+
+# queue handler & listener, started by setup()
+queue_handler: "DroppingQueueHandler | None" = None
+listener: QueueListener | None = None
+
+# max number of records waiting to be written
+LOG_QUEUE_SIZE = 10000
+
+
+@cache
+def get_config() -> dict:
+    """Load .env file & get config"""
+    # working with env
+    from dotenv import load_dotenv
+
+    # reading setings
+    import tomli
+
+    load_dotenv()
+    return tomli.load(Path(os.getenv("PATH_SETTINGS")).open("rb"))
+
+
+def compress_segment(source: str, dest: str) -> None:
+    """Compress rotated log segment with gzip
+
+    Segment is written to hidden temporary file first, so it isn't shipped,
+    until it is complete.
+    """
+    tmp = Path(dest).with_name(f".{Path(dest).name}.tmp")
+    with open(source, "rb") as src, gzip.open(tmp, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(tmp, dest)
+    os.remove(source)
+
+
+class SegmentFileHandler(BaseRotatingHandler):
+    """Log file handler, which starts new segment, when current one is too big
+    or too old
+
+    Current segment is always written to `filename` (named after start time
+    of the run), closed segments are renamed to `<name>.<number>.log` and
+    gzipped if `compress` is set.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        max_bytes: int = 0,
+        interval: int = 0,
+        compress: bool = True,
+    ):
+        super().__init__(filename, "a", encoding="utf-8", delay=True)
+        self.max_bytes, self.interval = max_bytes, interval
+        self.rollover_at = time.time() + interval
+        self.segments: list[Path] = []
+        if compress:
+            self.namer = lambda name: f"{name}.gz"
+            self.rotator = compress_segment
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.interval and time.time() >= self.rollover_at:
+            return True
+        if self.max_bytes and self.stream:
+            return self.stream.tell() >= self.max_bytes
+        return False
+
+    def doRollover(self) -> None:
+        self.rollover_at = time.time() + self.interval
+        if not self.stream:
+            return
+        self.stream.close()
+        self.stream = None
+        base = Path(self.baseFilename)
+        n = len(self.segments) + 1
+        dest = self.rotation_filename(str(base.with_suffix(f".{n:03d}.log")))
+        self.rotate(self.baseFilename, dest)
+        self.segments.append(Path(dest))
+
+
+class RateLimitFilter(logging.Filter):
+    """Let through at most `burst` records of every message per `period`
+
+    Only records up to INFO are limited. Number of suppressed records is
+    added to the next record of the same message, which gets through.
+    """
 
-def get_file_handler() -> logging.FileHandler | None:
+    def __init__(self, period: float = 60, burst: int = 20):
+        super().__init__()
+        self.period, self.burst = period, burst
+        # (logger, message) -> [period start, count, suppressed]
+        self.counts: dict[tuple[str, str], list] = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        key, now = (record.name, str(record.msg)), time.monotonic()
+        with self.lock:
+            if not (count := self.counts.get(key)) or (
+                now - count[0] >= self.period
+            ):
+                count = self.counts[key] = [now, 0, count[2] if count else 0]
+            if count[1] >= self.burst:
+                count[2] += 1
+                return False
+            count[1] += 1
+            suppressed, count[2] = count[2], 0
+        if suppressed:
+            record.msg = f"{record.msg} [{suppressed} similar suppressed]"
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue handler, which drops records, when queue is full"""
+
+    dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def get_file_handler() -> SegmentFileHandler | None:
     """Create file handler"""
-    file_log = config["log"]["file"]
+    file_log = get_config()["log"]["file"]
     if file_log["enable"]:
         root_log.info("Logging to file enabled.")
         log_dir = file_dir / file_log["path"]
@@ -54,7 +176,12 @@ def get_file_handler() -> logging.FileHandler | None:
         log_file = log_dir / log_name
         root_log.info("Logging to file: %r.", log_name)
         # add file handler
-        fh = logging.FileHandler(log_file, encoding="utf-8")
+        fh = SegmentFileHandler(
+            log_file,
+            max_bytes=file_log.get("max_bytes", 0),
+            interval=file_log.get("interval", 0),
+            compress=file_log.get("compress", True),
+        )
         fh.setFormatter(logging.Formatter(file_log["form"]))
         fh.setLevel(file_log["level"])
         return fh
@@ -62,28 +189,51 @@ def get_file_handler() -> logging.FileHandler | None:
     return None
 
 
-# get file handler
-file_handler = get_file_handler()
-
-
-def add_file_handler(logger: logging.Logger | str) -> None:
-    """Add file handler to logger
-
-    Args:
-        logger (str): logger or name of logger
-    """
-    if not logger:
-        root_log.error("No logger to add file handler to.")
-    if not isinstance(logger, logging.Logger):
-        logger = logging.getLogger(name)
-    if file_handler:
-        logger.addHandler(file_handler)
-
-
-# setup root logger
-add_file_handler(root_log)
-
-# setup sqlalchemy loggers
-for name, module in config["log"]["sqlalchemy"].items():
-    if module["enable"]:
-        logging.getLogger(f"sqlalchemy.{name}").setLevel(module["level"])
+def setup() -> None:
+    """Set up loggers, called once on start"""
+    global file_handler, queue_handler, listener
+    config = get_config()
+
+    # set basic config to logger
+    logging.basicConfig(
+        format=config["log"]["form"],
+        level=config["log"]["level"],
+    )
+
+    # get file handler
+    file_handler = get_file_handler()
+
+    # write records from listener thread only
+    handlers = root_log.handlers[:] + ([file_handler] if file_handler else [])
+    for handler in root_log.handlers[:]:
+        root_log.removeHandler(handler)
+    queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    if (limit := config["log"].get("limit", {})).get("enable", False):
+        queue_handler.addFilter(
+            RateLimitFilter(limit["period"], limit["burst"])
+        )
+    root_log.addHandler(queue_handler)
+    listener = QueueListener(
+        queue_handler.queue, *handlers, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(stop)
+
+    # setup sqlalchemy loggers
+    for name, module in config["log"]["sqlalchemy"].items():
+        if module["enable"]:
+            logging.getLogger(f"sqlalchemy.{name}").setLevel(module["level"])
+
+
+def stop() -> None:
+    """Write queued records, then log from calling thread"""
+    global listener
+    if not listener:
+        return
+    if queue_handler.dropped:
+        root_log.warning("Dropped %d log records.", queue_handler.dropped)
+    listener.stop()
+    root_log.removeHandler(queue_handler)
+    for handler in listener.handlers:
+        root_log.addHandler(handler)
+    listener = None
@@ -0,0 +1,199 @@
+"""Metrics module
+
+Serves counters and histograms in Prometheus text format.
+"""
+import os
+import logging
+
+from typing import Callable
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+# import link types
+from extra import LinkType
+
+# get logger
+log = logging.getLogger("yoiyoi.extra.metrics")
+
+# address and port of metrics endpoint
+METRICS_ADDR = os.environ.get("METRICS_ADDR", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9090"))
+
+# seconds, from api calls up to video conversions
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+stage_seconds = Histogram(
+    "yoiyoi_stage_seconds",
+    "Time spent in processing stage.",
+    ["stage", "link_type", "provider"],
+    buckets=BUCKETS,
+)
+
+links_total = Counter(
+    "yoiyoi_links_total",
+    "Processed links.",
+    ["link_type", "provider", "outcome"],
+)
+
+bytes_total = Counter(
+    "yoiyoi_bytes_total",
+    "Downloaded and uploaded bytes.",
+    ["direction", "link_type"],
+)
+
+queue_depth = Gauge(
+    "yoiyoi_queue_depth",
+    "Tasks waiting in queue.",
+    ["queue"],
+)
+
+cache_requests = Counter(
+    "yoiyoi_cache_requests_total",
+    "Media downloads by cache result: hit, revalidated or miss.",
+    ["result"],
+)
+
+cache_saved_bytes = Counter(
+    "yoiyoi_cache_saved_bytes_total",
+    "Media bytes served from cache instead of network.",
+)
+
+cache_bytes = Gauge(
+    "yoiyoi_cache_bytes",
+    "Bytes of cached media.",
+)
+
+twitter_quota = Gauge(
+    "yoiyoi_twitter_quota_remaining",
+    "Remaining Twitter API requests of endpoint until reset.",
+    ["endpoint"],
+)
+
+budget_bytes = Gauge(
+    "yoiyoi_media_budget_bytes",
+    "Limit, currently reserved and peak bytes of media memory budget.",
+    ["kind"],
+)
+
+
+def labels(record: dict | None) -> tuple[str, str]:
+    """Get link type and provider labels of analytics record
+
+    Args:
+        record (dict | None): analytics record
+
+    Returns:
+        tuple[str, str]: link type and provider
+    """
+    if record is None:
+        return "none", "none"
+    return LinkType.getType(record["link_type"]), record["provider"] or "none"
+
+
+def observe(name: str, seconds: float, record: dict | None) -> None:
+    """Observe time of stage
+
+    Args:
+        name (str): stage name
+        seconds (float): time spent
+        record (dict | None): analytics record
+    """
+    stage_seconds.labels(name, *labels(record)).observe(seconds)
+
+
+def count(record: dict) -> None:
+    """Count processed link
+
+    Args:
+        record (dict): finished analytics record
+    """
+    link_type, provider = labels(record)
+    stage_seconds.labels("total", link_type, provider).observe(
+        record["total_time"]
+    )
+    links_total.labels(link_type, provider, record["outcome"]).inc()
+
+
+def add_bytes(record: dict | None, bytes_in: int, bytes_out: int) -> None:
+    """Count downloaded and uploaded bytes
+
+    Args:
+        record (dict | None): analytics record
+        bytes_in (int): downloaded bytes
+        bytes_out (int): uploaded bytes
+    """
+    link_type, _ = labels(record)
+    if bytes_in:
+        bytes_total.labels("in", link_type).inc(bytes_in)
+    if bytes_out:
+        bytes_total.labels("out", link_type).inc(bytes_out)
+
+
+def watch_queue(name: str, depth: Callable[[], int]) -> None:
+    """Report queue depth on every scrape
+
+    Args:
+        name (str): queue name
+        depth (Callable[[], int]): function returning queue depth
+    """
+    queue_depth.labels(name).set_function(depth)
+
+
+def watch_budget(kind: str, value: Callable[[], int]) -> None:
+    """Report memory budget on every scrape
+
+    Args:
+        kind (str): "limit", "reserved" or "peak"
+        value (Callable[[], int]): function returning bytes
+    """
+    budget_bytes.labels(kind).set_function(value)
+
+
+def watch_quota(endpoint: str, remaining: Callable[[], int]) -> None:
+    """Report remaining Twitter API quota on every scrape
+
+    Args:
+        endpoint (str): endpoint, e.g. "/2/tweets"
+        remaining (Callable[[], int]): function returning remaining requests
+    """
+    twitter_quota.labels(endpoint).set_function(remaining)
+
+
+def count_cache(result: str, saved: int) -> None:
+    """Count media download by cache result
+
+    Args:
+        result (str): "hit", "revalidated" or "miss"
+        saved (int): bytes served from cache
+    """
+    cache_requests.labels(result).inc()
+    if saved:
+        cache_saved_bytes.inc(saved)
+
+
+def watch_cache(value: Callable[[], int]) -> None:
+    """Report cache size on every scrape
+
+    Args:
+        value (Callable[[], int]): function returning bytes
+    """
+    cache_bytes.set_function(value)
+
+
+def start(port: int = METRICS_PORT) -> None:
+    """Serve metrics on local http port
+
+    Args:
+        port (int, optional): port. Defaults to METRICS_PORT.
+    """
+    try:
+        start_http_server(port, addr=METRICS_ADDR)
+    except OSError as ex:
+        # e.g. another local worker has the port, take any free one
+        log.warning("Couldn't serve metrics on port %d: %s.", port, ex)
+        try:
+            server, _ = start_http_server(0, addr=METRICS_ADDR)
+        except OSError as ex:
+            return log.error("Couldn't serve metrics: %s.", ex)
+        port = server.server_port
+    log.info("Serving metrics on %s:%d.", METRICS_ADDR, port)
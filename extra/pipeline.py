@@ -0,0 +1,121 @@
+"""Pipeline module
+
+Items of multi-item posts go through stages (e.g. download, then convert),
+every stage in its own thread, connected by bounded queues. So next item is
+downloaded, while current one is converted, and results are used as soon as
+they are ready. Stages collect analytics and reserve memory for the link of
+calling thread.
+"""
+import os
+import queue
+import logging
+import threading
+
+from typing import Any, Callable, Iterable, Iterator
+from contextlib import suppress
+
+# import analytics & memory budget
+from extra import analytics, budget
+
+# get logger
+log = logging.getLogger("yoiyoi.extra.pipeline")
+
+# max number of items waiting between stages
+PIPELINE_QUEUE = int(os.environ.get("PIPELINE_QUEUE", "4"))
+
+# seconds to wait for stages to exit, when pipeline stops early
+PIPELINE_JOIN = 5
+
+# end of items
+_done = object()
+
+
+class _Failed:
+    """Exception of stage, passed through the rest of stages"""
+
+    def __init__(self, ex: Exception):
+        self.ex = ex
+
+
+def run(
+    items: Iterable,
+    *stages: Callable[[Any], Any],
+    size: int = PIPELINE_QUEUE,
+) -> Iterator:
+    """Run items through stages, yield results in order of items
+
+    Exception of any stage is raised, when its item is reached.
+
+    Args:
+        items (Iterable): items
+        stages (Callable[[Any], Any]): functions, which take result of
+        previous stage
+        size (int, optional): max number of items waiting between stages.
+        Defaults to PIPELINE_QUEUE.
+
+    Yields:
+        Any: result of the last stage
+    """
+    record, link_scope = analytics.current(), budget.current()
+    stop = threading.Event()
+    queues = [queue.Queue(size) for _ in range(len(stages) + 1)]
+
+    def put(q: queue.Queue, item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def feed():
+        for item in items:
+            if not put(queues[0], item):
+                return
+        put(queues[0], _done)
+
+    def work(func: Callable, source: queue.Queue, dest: queue.Queue):
+        with analytics.bind(record), budget.bind(link_scope):
+            while (item := source.get()) is not _done:
+                if stop.is_set():
+                    return
+                if not isinstance(item, _Failed):
+                    try:
+                        item = func(item)
+                    except Exception as ex:
+                        item = _Failed(ex)
+                if not put(dest, item):
+                    return
+            put(dest, _done)
+
+    threads = [threading.Thread(target=feed, name="pipeline", daemon=True)] + [
+        threading.Thread(
+            target=work,
+            args=(func, queues[n], queues[n + 1]),
+            name=f"pipeline-{func.__name__}",
+            daemon=True,
+        )
+        for n, func in enumerate(stages)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        while (item := queues[-1].get()) is not _done:
+            if isinstance(item, _Failed):
+                raise item.ex
+            yield item
+    finally:
+        # let stages exit, when results aren't needed anymore
+        stop.set()
+        for q in queues:
+            with suppress(queue.Empty):
+                while True:
+                    q.get_nowait()
+            with suppress(queue.Full):
+                q.put_nowait(_done)
+        # stages must not reserve memory for the link after it is done
+        for thread in threads:
+            thread.join(PIPELINE_JOIN)
+            if thread.is_alive():
+                log.warning("Pipeline stage %r is still running.", thread.name)
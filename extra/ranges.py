@@ -0,0 +1,194 @@
+"""Ranges module
+
+Large media is downloaded in chunks over several connections, as CDNs often
+throttle every connection. The first request asks for the first chunk: a
+partial response tells total size and proves `Range` support, so the rest of
+chunks are fetched in parallel into a preallocated file. Any other response
+is written as a single stream.
+"""
+import os
+import re
+import logging
+
+from typing import Callable
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# http requests
+import requests
+
+from requests.adapters import HTTPAdapter
+
+# import fake headers
+from extra.helper import fake_headers
+
+# get logger
+log = logging.getLogger("yoiyoi.extra.ranges")
+
+# number of connections per download
+RANGE_PARTS = int(os.environ.get("RANGE_PARTS", "4"))
+
+# bytes per request
+RANGE_CHUNK = int(os.environ.get("RANGE_CHUNK", str(4 << 20)))
+
+# tries of every chunk
+RANGE_TRIES = 2
+
+# bytes per write
+BLOCK_SIZE = 1 << 16
+
+# set download timeout
+TIMEOUT = 30
+
+
+class RangeError(IOError):
+    """Server returned wrong part of file"""
+
+
+def get_total(r: requests.Response) -> int:
+    """Get total size from partial response, 0 if unknown
+
+    Args:
+        r (requests.Response): response
+
+    Returns:
+        int: total size
+    """
+    match = re.fullmatch(
+        r"bytes (\d+)-(\d+)/(\d+)", r.headers.get("Content-Range", "")
+    )
+    return int(match[3]) if match else 0
+
+
+def write(r: requests.Response, file: Path, start: int, length: int) -> int:
+    """Write response body into file from offset
+
+    Args:
+        r (requests.Response): streamed response
+        file (Path): preallocated file
+        start (int): offset
+        length (int): expected number of bytes
+
+    Raises:
+        RangeError: number of bytes doesn't match
+
+    Returns:
+        int: number of written bytes
+    """
+    written = 0
+    with file.open("r+b") as f:
+        f.seek(start)
+        for block in r.iter_content(BLOCK_SIZE):
+            written += f.write(block)
+    if written != length:
+        raise RangeError(f"Got {written} of {length} bytes from {start}.")
+    return written
+
+
+def fetch(
+    s: requests.Session,
+    url: str,
+    file: Path,
+    start: int,
+    end: int,
+) -> int:
+    """Download chunk of file into its place
+
+    Args:
+        s (requests.Session): session
+        url (str): media link
+        file (Path): preallocated file
+        start (int): first byte
+        end (int): last byte
+
+    Returns:
+        int: number of written bytes
+    """
+    for tries in range(1, RANGE_TRIES + 1):
+        try:
+            with s.get(
+                url=url,
+                headers={**fake_headers, "Range": f"bytes={start}-{end}"},
+                allow_redirects=True,
+                stream=True,
+                timeout=TIMEOUT,
+            ) as r:
+                if r.status_code != 206 or not r.headers.get(
+                    "Content-Range", ""
+                ).startswith(f"bytes {start}-"):
+                    raise RangeError(f"Got {r.status_code} for {start}-{end}.")
+                return write(r, file, start, end - start + 1)
+        except (requests.RequestException, RangeError) as ex:
+            if tries == RANGE_TRIES:
+                raise
+            log.warning("Retrying chunk %d-%d: %s.", start, end, ex)
+
+
+def download(
+    url: str,
+    file: Path,
+    check: Callable[[int], None] | None = None,
+) -> int:
+    """Download media to file, in parallel chunks, if server supports it
+
+    Args:
+        url (str): media link
+        file (Path): file to write
+        check (Callable[[int], None] | None, optional): called with total
+        size before writing, may raise to abort. Defaults to None.
+
+    Raises:
+        RangeError: number of downloaded bytes doesn't match
+
+    Returns:
+        int: size of file
+    """
+    with requests.session() as s:
+        s.mount("https://", HTTPAdapter(pool_maxsize=RANGE_PARTS))
+        s.mount("http://", HTTPAdapter(pool_maxsize=RANGE_PARTS))
+        with s.get(
+            url=url,
+            headers={**fake_headers, "Range": f"bytes=0-{RANGE_CHUNK - 1}"},
+            allow_redirects=True,
+            stream=True,
+            timeout=TIMEOUT,
+        ) as r:
+            r.raise_for_status()
+            # no range support, single stream
+            if r.status_code != 206 or not (total := get_total(r)):
+                log.debug("No range support, downloading as a whole...")
+                if check:
+                    check(int(r.headers.get("Content-Length", 0)))
+                with file.open("wb") as f:
+                    for block in r.iter_content(BLOCK_SIZE):
+                        f.write(block)
+                return file.stat().st_size
+            if check:
+                check(total)
+            # preallocate file
+            with file.open("wb") as f:
+                f.truncate(total)
+            ranges = [
+                (start, min(start + RANGE_CHUNK, total) - 1)
+                for start in range(RANGE_CHUNK, total, RANGE_CHUNK)
+            ]
+            log.debug(
+                "Downloading %d bytes in %d chunks...", total, 1 + len(ranges)
+            )
+            with ThreadPoolExecutor(max(RANGE_PARTS - 1, 1)) as pool:
+                futures = [
+                    pool.submit(fetch, s, url, file, start, end)
+                    for start, end in ranges
+                ]
+                try:
+                    # the first chunk is written by this thread meanwhile
+                    size = write(r, file, 0, min(RANGE_CHUNK, total))
+                    size += sum(future.result() for future in futures)
+                except Exception:
+                    for future in futures:
+                        future.cancel()
+                    raise
+    # file is preallocated, so count bytes of every range
+    if size != total:
+        raise RangeError(f"Got {size} of {total} bytes.")
+    return size
@@ -0,0 +1,155 @@
+"""Update recorder module
+
+Writes every received update to a file, one JSON object per line, to replay
+traffic later (see `bench.replay`).
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+
+# get logger
+log = logging.getLogger("yoiyoi.extra.recorder")
+
+# file to record updates to, empty to disable recording
+RECORD_UPDATES = os.environ.get("RECORD_UPDATES", "")
+
+# remove personal info before recording
+RECORD_ANONYMISE = bool(int(os.environ.get("RECORD_ANONYMISE", "1")))
+
+# secret of pseudonymous ids, new for every run
+_salt = os.urandom(16)
+_lock = threading.Lock()
+
+# personal info of users and chats
+_names = {
+    "first_name",
+    "last_name",
+    "username",
+    "title",
+    "bio",
+    "description",
+    "invite_link",
+    "phone_number",
+}
+
+# personal objects, which are dropped
+_private = {"contact", "location", "venue", "photo", "chat_photo"}
+
+# text fields, where only links are kept
+_texts = {"text", "caption", "query"}
+
+# links in text
+_links = re.compile(r"\S+\.\w+/\S*")
+
+# bot command, e.g. /start or /start@bot
+_command = re.compile(r"/\w+(@\w+)?")
+
+
+def get_commands(text: str) -> list[str]:
+    """Get bot commands at the start of text"""
+    commands = []
+    for token in text.split():
+        if not _command.fullmatch(token):
+            break
+        commands.append(token)
+    return commands
+
+
+def digest(value: str, salt: bytes = _salt) -> int:
+    """Get keyed hash of value as 12-digit number"""
+    _hash = hashlib.blake2b(value.encode(), key=salt, digest_size=6)
+    return int.from_bytes(_hash.digest(), "big") % 10**12 + 1
+
+
+def pseudo_id(_id: int, salt: bytes = _salt) -> int:
+    """Get pseudonymous id, which keeps sign of the original one
+
+    Args:
+        _id (int): user or chat id
+        salt (bytes, optional): secret. Defaults to secret of this run.
+
+    Returns:
+        int: pseudonymous id
+    """
+    new_id = digest(str(abs(_id)), salt)
+    return -new_id if _id < 0 else new_id
+
+
+def anonymise(data, salt: bytes = _salt):
+    """Remove personal info from update in JSON form
+
+    Users and chats get pseudonymous ids and names, texts keep only leading
+    bot commands and links.
+
+    Args:
+        data: update or any part of it
+        salt (bytes, optional): secret. Defaults to secret of this run.
+
+    Returns:
+        anonymised copy of data
+    """
+    if isinstance(data, list):
+        return [anonymise(item, salt) for item in data]
+    if not isinstance(data, dict):
+        return data
+    # user or chat
+    person = "first_name" in data or data.get("type", None) in (
+        "private",
+        "group",
+        "supergroup",
+        "channel",
+    )
+    result = {}
+    for key, value in data.items():
+        if key in _private:
+            continue
+        if (person and key == "id") or key in ("user_id", "chat_id"):
+            value = pseudo_id(value, salt) if isinstance(value, int) else value
+        elif key in _names and isinstance(value, str):
+            value = f"{key}{digest(value, salt)}"
+        elif key in _texts and isinstance(value, str):
+            value = " ".join(get_commands(value) + _links.findall(value))
+        elif key in ("entities", "caption_entities"):
+            # bot commands are at the start of anonymised text
+            text = data.get("text" if key == "entities" else "caption", "")
+            commands, offset = [], 0
+            for command in get_commands(text or ""):
+                commands.append(
+                    {
+                        "type": "bot_command",
+                        "offset": offset,
+                        "length": len(command),
+                    }
+                )
+                offset += len(command) + 1
+            # keep only hidden links, their offsets don't matter anymore
+            value = commands + [
+                {"type": e["type"], "offset": 0, "length": 0, "url": e["url"]}
+                for e in value
+                if "url" in e
+            ]
+        else:
+            value = anonymise(value, salt)
+        result[key] = value
+    return result
+
+
+def record(update, _) -> None:
+    """Append update to `RECORD_UPDATES` file
+
+    Args:
+        update (Update): telegram update object
+    """
+    data = update.to_dict()
+    if RECORD_ANONYMISE:
+        data = anonymise(data)
+    line = json.dumps({"time": time.time(), "update": data})
+    try:
+        with _lock, open(RECORD_UPDATES, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+    except OSError as ex:
+        log.error("Exception occured: %s.", ex)
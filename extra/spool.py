@@ -0,0 +1,126 @@
+"""Spool module
+
+Temporary media files live in a directory of the current process inside
+`yoiyoi-spool` of `SPOOL_DIR` (tmpfs, if available). Files are removed when
+their scope exits, directories of dead processes are swept on start, and new
+files fail fast when the spool is over `SPOOL_QUOTA`.
+
+With local bot api server (`BOT_API_URL`) files are up to 2000 MB, so they
+are spooled on disk by default, and the default quota fits two of them.
+"""
+import os
+import uuid
+import shutil
+import atexit
+import logging
+import tempfile
+
+from pathlib import Path
+from contextlib import contextmanager
+
+# get logger
+log = logging.getLogger("yoiyoi.extra.spool")
+
+
+# big files of local bot api server
+LOCAL_MODE = bool(os.environ.get("BOT_API_URL", ""))
+
+
+def default_dir() -> str:
+    """Use tmpfs, if available and files are small"""
+    shm = Path("/dev/shm")
+    base = None
+    if not LOCAL_MODE and shm.is_dir() and os.access(shm, os.W_OK):
+        base = shm
+    return str(base or tempfile.gettempdir())
+
+
+# spool location, only dedicated directory inside is ever touched
+SPOOL_DIR = Path(os.environ.get("SPOOL_DIR", "") or default_dir()) / (
+    "yoiyoi-spool"
+)
+
+# max bytes of all spooled files
+SPOOL_QUOTA = int(
+    os.environ.get("SPOOL_QUOTA", str((4000 if LOCAL_MODE else 256) << 20))
+)
+
+# directory of current process
+spool_dir = SPOOL_DIR / str(os.getpid())
+
+
+class SpoolFull(OSError):
+    """Spool quota is exceeded"""
+
+
+def usage() -> int:
+    """Get bytes used by all spooled files"""
+    return sum(
+        file.stat().st_size for file in SPOOL_DIR.glob("*/*") if file.is_file()
+    )
+
+
+def check(size: int) -> None:
+    """Fail fast, if file of given size doesn't fit into quota
+
+    Args:
+        size (int): file size, 0 if unknown
+
+    Raises:
+        SpoolFull: quota is exceeded
+    """
+    if (used := usage()) + size > SPOOL_QUOTA:
+        raise SpoolFull(f"Spool is full: {used} + {size} > {SPOOL_QUOTA}.")
+
+
+@contextmanager
+def path(name: str = ""):
+    """Get unique path in spool, removed with all its `<path>.*` files on exit
+
+    Args:
+        name (str, optional): readable part of file name. Defaults to "".
+
+    Yields:
+        Path: unique path
+    """
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    file = spool_dir / f"{name}-{uuid.uuid4().hex}"
+    try:
+        yield file
+    finally:
+        for item in [file, *spool_dir.glob(f"{file.name}.*")]:
+            item.unlink(missing_ok=True)
+
+
+def alive(pid: str) -> bool:
+    """Check, if process is running"""
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def sweep() -> None:
+    """Remove spool directories of processes, which aren't running, and
+    of previous process with the same pid"""
+    if not SPOOL_DIR.is_dir():
+        return
+    for item in SPOOL_DIR.iterdir():
+        # only directories of processes
+        if not item.name.isdigit() or not item.is_dir():
+            continue
+        if item != spool_dir and alive(item.name):
+            continue
+        log.info("Removing leftover spool: %r.", item.name)
+        shutil.rmtree(item, ignore_errors=True)
+
+
+def cleanup() -> None:
+    """Remove spool directory of current process"""
+    shutil.rmtree(spool_dir, ignore_errors=True)
+
+
+atexit.register(cleanup)
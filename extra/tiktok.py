@@ -1,12 +1,13 @@
 """TikTok module"""
 import re
 import logging
+import threading
 
 # http requests
 import requests
 
-# import link dictionary
-from extra import link_dict
+# import link dictionary and analytics
+from extra import link_dict, analytics
 
 # import fake headers and getting file size function
 from extra.helper import fake_headers, get_file_size
@@ -20,11 +21,57 @@
 # tiktok thumbnail link
 thumb = "https://www.tiktok.com/api/img/?itemId={0}&location={1}"
 
+# resolved short links: short link -> video id
+_short_ids: dict[str, str] = {}
+_short_lock = threading.Lock()
+
+# max number of resolved short links to keep
+SHORT_CACHE_SIZE = 4096
+
 ################################################################################
 # tiktok
 ################################################################################
 
 
+def get_tiktok_id(link: str) -> str | None:
+    """Resolve short tiktok link (vm.tiktok.com, vt.tiktok.com) to video id
+
+    Redirect is followed only once, with HEAD request, and result is cached.
+
+    Args:
+        link (str): formatted short tiktok link
+
+    Returns:
+        str | None: tiktok video id
+    """
+    with _short_lock:
+        if _id := _short_ids.get(link, None):
+            log.debug("Short link %r is cached: %s.", link, _id)
+            return _id
+    try:
+        res = requests.head(
+            url=link,
+            headers=fake_headers,
+            allow_redirects=False,
+            timeout=5,
+        )
+    except requests.exceptions.RequestException as ex:
+        log.warning("Exception occured: %s.", ex)
+        return None
+    location = res.headers.get("Location", "")
+    if not (match := re.search(link_dict["tiktok"]["re"], location)):
+        log.warning("Couldn't resolve short link %r: %r.", link, location)
+        return None
+    _id = match.group("id")
+    log.info("Resolved short link %r: %s.", link, _id)
+    with _short_lock:
+        # forget the oldest link
+        if len(_short_ids) >= SHORT_CACHE_SIZE:
+            _short_ids.pop(next(iter(_short_ids)))
+        _short_ids[link] = _id
+    return _id
+
+
 def get_yt4k_links(link: str) -> TikTokVideo:
     """Makes POST request to YouTube4K API
 
@@ -70,6 +117,7 @@ def get_yt4k_links(link: str) -> TikTokVideo:
                     link_hd = tto["url"]
             log.info("YouTube4K: Collecting file sizes...")
             if size := get_file_size(link):
+                analytics.provider("youtube4k")
                 return TikTokVideo(
                     link_dict["tiktok"]["link"].format(id=_id),
                     _id,
@@ -128,6 +176,7 @@ def get_tikmate_links(link: str) -> TikTokVideo:
             link_hd = tikmate.format(_token, _id, "?hd=1")
             log.info("TikMate: Collecting file sizes...")
             if size := get_file_size(link):
+                analytics.provider("tikmate")
                 return TikTokVideo(
                     link_dict["tiktok"]["source"].format(
                         id=_id,
@@ -186,6 +235,7 @@ def get_lovetik_links(link: str) -> TikTokVideo:
             link = link_hd = r["links"][0]["a"]
             log.info("LoveTik: Collecting file sizes...")
             if size := get_file_size(link):
+                analytics.provider("lovetik")
                 return TikTokVideo(
                     link_dict["tiktok"]["source"].format(
                         id=_id,
@@ -210,6 +260,7 @@ def get_lovetik_links(link: str) -> TikTokVideo:
     return None
 
 
+@analytics.timed("resolve")
 def get_tiktok_links(link: str) -> TikTokVideo:
     """Gets links for tiktok provided by link
 
@@ -1,7 +1,9 @@
 """Twitter module"""
 import os
 import re
+import time
 import logging
+import threading
 
 # http requests
 import requests
@@ -9,11 +11,11 @@
 # twitter
 import tweepy
 
-# import link dictionary
-from extra import link_dict
+# import link dictionary, analytics and metrics
+from extra import link_dict, analytics, metrics
 
-# import fake headers
-from extra.helper import fake_headers
+# import fake headers and max image size
+from extra.helper import fake_headers, IM_MAX
 
 # import TwitterMedia
 from extra.namedtuples import TwitterMedia
@@ -21,15 +23,134 @@
 # get logger
 log = logging.getLogger("yoiyoi.extra.twitter")
 
+# server-side image variants and their max side length
+image_variants = (
+    ("small", 680),
+    ("medium", 1200),
+    ("large", 2048),
+    ("4096x4096", 4096),
+)
+
+################################################################################
+# twitter api client
+################################################################################
+
+
+class Client(tweepy.Client):
+    """Twitter API client, which keeps track of rate limits
+
+    Remaining requests are taken from `x-rate-limit-*` response headers for
+    every endpoint. When there are no requests left, calls to that endpoint
+    wait for the limit to reset instead of failing.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, wait_on_rate_limit=True, **kwargs)
+        # endpoint -> {"limit": int, "remaining": int, "reset": int}
+        self.limits: dict[str, dict[str, int]] = {}
+        self.limits_lock = threading.Lock()
+
+    @staticmethod
+    def endpoint(route: str) -> str:
+        """Endpoint of route: /2/tweets/1 -> /2/tweets/:id"""
+        return re.sub(r"/\d{3,}(?=/|$)", "/:id", route)
+
+    def request(self, method, route, params=None, json=None, user_auth=False):
+        key = self.endpoint(route)
+        # wait for reset without holding the lock
+        while True:
+            with self.limits_lock:
+                limit = self.limits.get(key)
+                if not limit or limit["remaining"] > 0:
+                    wait = 0
+                else:
+                    wait = limit["reset"] - time.time() + 1
+                if wait <= 0:
+                    if limit:
+                        limit["remaining"] -= 1
+                    break
+            log.warning("Rate limit of %s: waiting %d seconds.", key, wait)
+            time.sleep(wait)
+        res = super().request(method, route, params, json, user_auth)
+        if "x-rate-limit-remaining" in res.headers:
+            with self.limits_lock:
+                if key not in self.limits:
+                    metrics.watch_quota(key, lambda: self.remaining(key))
+                self.limits[key] = {
+                    "limit": int(res.headers["x-rate-limit-limit"]),
+                    "remaining": int(res.headers["x-rate-limit-remaining"]),
+                    "reset": int(res.headers["x-rate-limit-reset"]),
+                }
+            log.debug("Rate limit of %s: %r.", key, self.limits[key])
+        return res
+
+    def remaining(self, key: str) -> int:
+        """Get remaining requests of endpoint"""
+        with self.limits_lock:
+            return self.limits[key]["remaining"]
+
+
+# shared client, created on first use
+_client: Client | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> Client:
+    """Get shared Twitter API client
+
+    Returns:
+        Client: twitter api client
+    """
+    global _client
+    if not _client:
+        with _client_lock:
+            if not _client:
+                log.debug("Starting Twitter API client...")
+                _client = Client(os.environ["TW_TOKEN"])
+    return _client
+
+
+def get_rate_limits() -> dict[str, dict[str, int]]:
+    """Get remaining quota of every used endpoint
+
+    Returns:
+        dict[str, dict[str, int]]: endpoint -> limit, remaining and reset
+    """
+    if not _client:
+        return {}
+    with _client.limits_lock:
+        return {key: limit.copy() for key, limit in _client.limits.items()}
+
+
 ################################################################################
 # twitter
 ################################################################################
 
 
+def get_variant_name(width: int, height: int) -> str:
+    """Get the smallest image variant, which fits into `IM_MAX` and keeps
+    as much of the original size as possible
+
+    Args:
+        width (int): original image width
+        height (int): original image height
+
+    Returns:
+        str: variant name
+    """
+    fits = [item for item in image_variants if item[1] <= max(IM_MAX)]
+    if not (width and height):
+        return fits[-1][0]
+    side = max(width, height)
+    return next((name for name, size in fits if size >= side), fits[-1][0])
+
+
 def get_twitter_media(
     tweet_id: int,
     media_type: str = None,
     image_list: list[str] = None,
+    variants: list[dict] = None,
+    sizes: list[tuple[int, int]] = None,
 ) -> list[list[str], list[str]]:
     """Collect media links from tweet data
 
@@ -38,32 +159,57 @@ def get_twitter_media(
         media_type (str, optional): "photo", "video" or "animated_gif".
         Defaults to None.
         image_list (list[str], optional): list of image links. Defaults to None.
+        variants (list[dict], optional): video variants returned by twitter
+        api. Defaults to None.
+        sizes (list[tuple[int, int]], optional): width and height of every
+        image. Defaults to None.
 
     Returns:
-        list[list[str], list[str]]: media links
+        list[list[str], list[str]]: original links and links for preview
     """
     if media_type == "photo":
-        links = []
-        for url in image_list:
+        analytics.provider("twitter")
+        links, thumbs = [], []
+        for url, size in zip(image_list, sizes or [(0, 0)] * len(image_list)):
             args = re.search(link_dict["twitter"]["file"], url).groupdict()
             links.append(link_dict["twitter"]["full"].format(**args))
-        return [links, [link.replace("orig", "large") for link in links]]
+            thumbs.append(
+                link_dict["twitter"]["variant"].format(
+                    id=args["id"],
+                    name=get_variant_name(*size),
+                )
+            )
+        return [links, thumbs]
+    # highest and second highest bitrate
+    if var := sorted(
+        (v for v in variants or [] if v.get("content_type") == "video/mp4"),
+        key=lambda v: v.get("bit_rate", 0),
+        reverse=True,
+    ):
+        analytics.provider("twitter")
+        return [[var[0]["url"]], [var[1 % len(var)]["url"]]]
     else:
+        log.warning("No video variants, trying another API: TweetPik...")
         base = "https://tweetpik.com/twitter-downloader/"
         api = f"https://tweetpik.com/api/tweets/{tweet_id}/video"
         log.debug("Sending request to API: %s...", api)
-        s = requests.session()
-        res = s.post(
-            url=api,
-            headers={
-                **fake_headers,
-                "Referer": base,
-            },
-        )
+        try:
+            res = requests.post(
+                url=api,
+                headers={
+                    **fake_headers,
+                    "Referer": base,
+                },
+                timeout=10,
+            )
+        except requests.exceptions.RequestException as ex:
+            log.warning("Exception occured: %s.", ex)
+            return None
         if res.status_code != 200:
             log.warning("Service is unavailable.")
             return None
         log.debug("Received json: %s.", res.json())
+        analytics.provider("tweetpik")
         var = res.json()["variants"]
         return [
             [var[-1 % len(var)]["url"]],
@@ -71,55 +217,77 @@ def get_twitter_media(
         ]
 
 
-def get_twitter_links(tid: int | str) -> TwitterMedia:
-    """Get illustration info with twitter api by id
+# fields to request with every tweet
+tweet_lookup = {
+    "expansions": [
+        "attachments.media_keys",
+        "author_id",
+    ],
+    "tweet_fields": [
+        "id",
+        "text",
+        "created_at",
+        "entities",
+        "attachments",
+        "author_id",
+    ],
+    "user_fields": [
+        "id",
+        "name",
+        "username",
+    ],
+    "media_fields": [
+        "type",
+        "width",
+        "height",
+        "preview_image_url",
+        "url",
+        "duration_ms",
+        "variants",
+    ],
+}
+
+# max number of tweets per lookup
+TWEETS_MAX = 100
+
+
+def parse_tweet(
+    data: tweepy.Tweet,
+    users: dict[int, tweepy.User],
+    media: dict[str, tweepy.Media],
+) -> TwitterMedia:
+    """Collect tweet info from api response
 
     Args:
-        tid (int): tweet id
+        data (tweepy.Tweet): tweet
+        users (dict[int, tweepy.User]): included users by id
+        media (dict[str, tweepy.Media]): included media by media key
 
     Returns:
-        ArtWorkMedia: artwork object
+        TwitterMedia: twitter media object
     """
-    log.debug("Starting Twitter API client...")
-    client = tweepy.Client(os.environ["TW_TOKEN"])
-    res = client.get_tweet(
-        id=tid,
-        expansions=[
-            "attachments.media_keys",
-            "author_id",
-        ],
-        tweet_fields=[
-            "id",
-            "text",
-            "created_at",
-            "entities",
-        ],
-        user_fields=[
-            "id",
-            "name",
-            "username",
-        ],
-        media_fields=[
-            "type",
-            "width",
-            "height",
-            "preview_image_url",
-            "url",
-            "duration_ms",
-        ],
-    )
-    log.debug("Response: %r.", res)
-    if error := res.errors:
-        return log.error("%s: %s", error[0]["title"], error[0]["detail"])
-    if not (media := res.includes.get("media", None)):
-        return log.error("Exception occured: No media.")
-    user, kind, data = res.includes["users"][0], media[0].type, res.data
+    tid = data.id
+    media = [
+        media[key]
+        for key in (data.attachments or {}).get("media_keys", [])
+        if key in media
+    ]
+    if not media:
+        return log.error("Exception occured: No media in tweet %s.", tid)
+    user, kind = users[data.author_id], media[0].type
     if kind == "photo":
-        links = get_twitter_media(tid, kind, [e.url for e in media])
+        links = get_twitter_media(
+            tid,
+            kind,
+            [e.url for e in media],
+            sizes=[(e.width, e.height) for e in media],
+        )
     else:
-        links = get_twitter_media(tid, kind)
-    if not links[0]:
-        return log.error("Exception occured: No links.")
+        links = get_twitter_media(
+            tid, kind, variants=getattr(media[0], "variants", None)
+        )
+    if not links or not links[0]:
+        return log.error("Exception occured: No links in tweet %s.", tid)
     text, posttext = data.text.rsplit(
         next(
             filter(
@@ -146,3 +314,47 @@ def get_twitter_links(tid: int | str) -> TwitterMedia:
         links[0],
         links[1],
     )
+
+
+def get_twitter_tweets(tids: list[int | str]) -> dict[str, TwitterMedia]:
+    """Get info of several tweets with twitter api, 100 tweets per request
+
+    Args:
+        tids (list[int | str]): tweet ids
+
+    Returns:
+        dict[str, TwitterMedia]: tweet id -> twitter media object
+    """
+    result = {}
+    tids = [str(tid) for tid in tids]
+    for start in range(0, len(tids), TWEETS_MAX):
+        res = get_client().get_tweets(
+            ids=tids[start : start + TWEETS_MAX],
+            **tweet_lookup,
+        )
+        log.debug("Response: %r.", res)
+        for error in res.errors:
+            log.error(
+                "%s: %s",
+                error.get("title", "Error"),
+                error.get("detail", error),
+            )
+        users = {user.id: user for user in res.includes.get("users", [])}
+        media = {item.media_key: item for item in res.includes.get("media", [])}
+        for data in res.data or []:
+            if tweet := parse_tweet(data, users, media):
+                result[str(data.id)] = tweet
+    return result
+
+
+@analytics.timed("resolve")
+def get_twitter_links(tid: int | str) -> TwitterMedia:
+    """Get illustration info with twitter api by id
+
+    Args:
+        tid (int): tweet id
+
+    Returns:
+        TwitterMedia: twitter media object
+    """
+    return get_twitter_tweets([tid]).get(str(tid), None)
@@ -1,8 +1,19 @@
-"""Upload module"""
+"""Upload module
+
+Closed log segments are shipped in background, chunk by chunk, the current
+one is shipped on shutdown. Shipped offset of every file is kept in
+`upload.json` next to the logs, so failed uploads resume where they left off.
+
+The endpoint at `GD_LOG` has to take `name` and `offset` parameters, append
+the chunk at that offset and answer `{"ok": bool, "offset": int}` with its
+current size of the file. Endpoints, which only answer `{"ok": false}` for
+taken names, can take whole files only, as the first chunk.
+"""
 import os
-import time
+import json
 import base64
 import logging
+import threading
 
 from pathlib import Path
 
@@ -10,42 +21,156 @@
 import requests
 
 # logger file handler
-from extra.loggers import file_handler
+from extra import loggers
 
 # get logger
 log = logging.getLogger("yoiyoi.upload")
 
+# seconds between shipping closed log segments
+LOG_SHIP_INTERVAL = int(os.environ.get("LOG_SHIP_INTERVAL", "300"))
+
 # set upload timeout
-UPLOAD_TIMEOUT = 3
+UPLOAD_TIMEOUT = 30
 
+# bytes per request and per encoded block, multiples of 3, so base64 of
+# consecutive chunks can be joined
+CHUNK_SIZE = 3 << 20
+BLOCK_SIZE = 3 << 14
 
-def upload_log() -> None:
-    """Upload log file to Google Drive"""
-    if not file_handler:
-        return  # silently exit
-    if not (link := os.environ["GD_LOG"]):
-        return log.error("No log upload link.")
-    if not (file := Path(file_handler.baseFilename)).exists():
-        return log.error("No such file!")
-    for attempt in range(3):
-        if attempt:
-            log.info("Waiting for %d seconds...", UPLOAD_TIMEOUT)
-            time.sleep(UPLOAD_TIMEOUT)
-            log.info("Done. Current attempt: #%d.", attempt + 1)
+# one shipping at a time
+_lock = threading.Lock()
+_stop = threading.Event()
+_thread: threading.Thread | None = None
+
+
+class Base64Reader:
+    """File part, which is read as base64 block by block"""
+
+    def __init__(self, file: Path, offset: int, length: int):
+        self.file = file.open("rb")
+        self.file.seek(offset)
+        self.left, self.buffer = length, b""
+        self.length = (length + 2) // 3 * 4
+
+    def __len__(self) -> int:
+        return self.length
+
+    def read(self, size: int = -1) -> bytes:
+        while (size < 0 or len(self.buffer) < size) and self.left:
+            if not (block := self.file.read(min(BLOCK_SIZE, self.left))):
+                break
+            self.left -= len(block)
+            self.buffer += base64.urlsafe_b64encode(block)
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def ship_file(link: str, file: Path, offsets: dict, state: Path) -> bool:
+    """Upload log file to Google Drive from last shipped offset
+
+    Args:
+        link (str): upload link
+        file (Path): log file
+        offsets (dict): file name -> shipped bytes
+        state (Path): file to save offsets to
+
+    Returns:
+        bool: True, if the whole file is shipped
+    """
+    offset, size = offsets.get(file.name, 0), file.stat().st_size
+    while offset < size:
+        length = min(CHUNK_SIZE, size - offset)
+        log.debug(
+            "Uploading %r from %d: %d bytes...", file.name, offset, length
+        )
+        reader = Base64Reader(file, offset, length)
         try:
-            log.info("Uploading log file %r...", file.name)
             r = requests.post(
                 url=link,
-                params={"name": file.name},
-                data=base64.urlsafe_b64encode(file.read_bytes()),
-            )
-            if r.json()["ok"]:
-                log.info("Done uploading log file %r.", file.name)
-            else:
-                log.info("Log file %r already exists.", file.name)
-            break
+                params={"name": file.name, "offset": offset},
+                data=reader,
+                timeout=UPLOAD_TIMEOUT,
+            ).json()
         except Exception as ex:
             log.error("Exception occured: %s.", ex)
-    else:
-        log.error("Error: Run out of attempts.")
-        log.error("Couldn't upload log file %r.", file.name)
+            return False
+        finally:
+            reader.close()
+        if r.get("ok"):
+            offset += length
+        # server has another part, resume from there
+        elif r.get("offset", offset) != offset:
+            log.warning("Resuming %r from %d.", file.name, r["offset"])
+            offset = r["offset"]
+        elif "offset" in r:
+            log.error("Couldn't upload log file %r.", file.name)
+            return False
+        # old endpoint only says, that the name is taken
+        elif not offset:
+            log.info("Log file %r already exists.", file.name)
+            offset = size
+        else:
+            log.error("Couldn't upload log file %r.", file.name)
+            return False
+        offsets[file.name] = offset
+        state.write_text(json.dumps(offsets))
+    return True
+
+
+def ship(final: bool = False) -> None:
+    """Upload closed log files, and the current one too, if final
+
+    Args:
+        final (bool, optional): ship current log file. Defaults to False.
+    """
+    if not (file_handler := loggers.file_handler):
+        return  # silently exit
+    if not (link := os.environ.get("GD_LOG", "")):
+        return log.error("No log upload link.")
+    current = Path(file_handler.baseFilename)
+    pref = loggers.get_config()["log"]["file"]["pref"]
+    state = current.parent / "upload.json"
+    with _lock:
+        offsets = json.loads(state.read_text()) if state.exists() else {}
+        for file in sorted(current.parent.glob(f"{pref}*")):
+            if file == state or (file == current and not final):
+                continue
+            if offsets.get(file.name, 0) >= file.stat().st_size:
+                continue
+            if ship_file(link, file, offsets, state):
+                log.info("Done uploading log file %r.", file.name)
+
+
+def start() -> threading.Thread:
+    """Start shipping closed log files in background
+
+    Returns:
+        threading.Thread: shipping thread
+    """
+    global _thread
+
+    def loop():
+        while not _stop.wait(LOG_SHIP_INTERVAL):
+            try:
+                ship()
+            except Exception as ex:
+                log.error("Couldn't ship log files: %s.", ex)
+
+    _thread = threading.Thread(target=loop, name="log-shipper", daemon=True)
+    _thread.start()
+    return _thread
+
+
+def upload_log() -> None:
+    """Upload the rest of log files on shutdown"""
+    _stop.set()
+    if _thread:
+        _thread.join()
+    # write queued records first
+    loggers.stop()
+    ship(final=True)
@@ -1,4 +1,5 @@
 """YouTube Short module"""
+import re
 import json
 import logging
 
@@ -7,8 +8,11 @@
 # http requests
 import requests
 
-# import fake headers
-from extra.helper import fake_headers, get_file_size
+# import analytics
+from extra import analytics
+
+# import fake headers, file size & provider sessions
+from extra.helper import fake_headers, get_file_size, get_session, drop_session
 
 # import ArtWorkMedia
 from extra.namedtuples import YouTubeShortMedia
@@ -16,8 +20,121 @@
 # get logger
 log = logging.getLogger("yoiyoi.extra.youtube_short")
 
+# default size limit of bot uploads
+SIZE_LIMIT = 50 << 20
+
+# margin of sizes estimated from bitrate
+ESTIMATE_MARGIN = 1.1
+
+
+def get_quality(fmt: dict) -> int:
+    """Get video height of format, 0 if unknown
+
+    Args:
+        fmt (dict): format from provider
+
+    Returns:
+        int: video height
+    """
+    match = re.search(r"\d+", str(fmt.get("quality", "")))
+    return int(match.group()) if match else 0
+
+
+def estimate_size(fmt: dict, duration: int) -> int:
+    """Estimate file size of format from its metadata, 0 if unknown
+
+    Args:
+        fmt (dict): format from provider
+        duration (int): video duration in seconds
+
+    Returns:
+        int: size in bytes
+    """
+    for key in ("filesize", "size", "contentLength"):
+        if str(fmt.get(key, "")).isdigit():
+            return int(fmt[key])
+    if str(bitrate := fmt.get("bitrate", "")).isdigit() and duration:
+        return int(int(bitrate) * duration / 8 * ESTIMATE_MARGIN)
+    return 0
+
 
-def get_ytshorts_links(link: str) -> Optional[YouTubeShortMedia]:
+def select_format(
+    formats: list[dict],
+    duration: int,
+    limit: int = SIZE_LIMIT,
+) -> tuple[str | None, int] | None:
+    """Select the best format, which fits into size limit
+
+    Formats are tried from the highest quality. Sizes are estimated from
+    metadata, HEAD requests are made only for formats without it.
+
+    Args:
+        formats (list[dict]): formats from provider
+        duration (int): video duration in seconds
+        limit (int, optional): max size. Defaults to SIZE_LIMIT.
+
+    Returns:
+        tuple[str | None, int] | None: link and size, None and the smallest
+        known size, if every known size is too big, None if no size is known
+    """
+    known = []
+    for fmt in sorted(formats, key=get_quality, reverse=True):
+        if not (size := estimate_size(fmt, duration)):
+            size = get_file_size(fmt["url"])
+        log.debug("Format %sp: %d bytes.", get_quality(fmt), size)
+        if 0 < size < limit:
+            return fmt["url"], size
+        if size:
+            known.append(size)
+    return (None, min(known)) if known else None
+
+
+def get_media(
+    source: str,
+    vid: str,
+    thumb: str,
+    title: str,
+    formats: list[dict],
+    duration: int,
+    limit: int,
+) -> Optional[YouTubeShortMedia]:
+    """Create YouTube Short media with the best and the smallest formats
+
+    Args:
+        source (str): YouTube Short link
+        vid (str): video id
+        thumb (str): thumbnail link
+        title (str): video title
+        formats (list[dict]): formats from provider
+        duration (int): video duration in seconds
+        limit (int): max size
+
+    Returns:
+        Optional[YouTubeShortMedia]: media, link is None if nothing fits,
+        None if no size is known
+    """
+    if not (selected := select_format(formats, duration, limit)):
+        log.warning("Couldn't get size of any format.")
+        return None
+    _link, size = selected
+    lowest = min(reversed(formats), key=get_quality)
+    return YouTubeShortMedia(
+        source,
+        vid,
+        thumb,
+        title,
+        _link,
+        lowest["url"],
+        size,
+        estimate_size(lowest, duration),
+        duration,
+    )
+
+
+def get_ytshorts_links(
+    link: str,
+    limit: int = SIZE_LIMIT,
+) -> Optional[YouTubeShortMedia]:
     base = "https://ytshorts.savetube.me/"
     api = "https://api.savetube.me/info"
     # get response
@@ -38,28 +155,21 @@ def get_ytshorts_links(link: str) -> Optional[YouTubeShortMedia]:
             r = response.json()
             log.debug("JSON: %r.", r)
             if r["status"]:
-                data, videos = r["data"], r["data"]["video_formats"]
-                _link = videos[0]["url"]
-                _link_lq = next(
-                    filter(
-                        lambda video: video["url"]
-                        and video["quality"] != videos[0]["quality"],
-                        data["video_formats"][1:],
-                    ),
-                    {},
-                ).get("url", None)
-                if size := get_file_size(_link):
-                    return YouTubeShortMedia(
+                data = r["data"]
+                videos = [v for v in data["video_formats"] if v["url"]]
+                if videos:
+                    media = get_media(
                         link,
                         data["id"],
                         data["thumbnail"],
                         data["title"],
-                        _link,
-                        _link_lq,
-                        size,
-                        get_file_size(_link_lq),
+                        videos,
                         data["duration"],
+                        limit,
                     )
+                    if media:
+                        analytics.provider("savetube")
+                    return media
             else:
                 log.error("Couldn't download video!")
         except json.decoder.JSONDecodeError as ex:
@@ -67,17 +177,18 @@ def get_ytshorts_links(link: str) -> Optional[YouTubeShortMedia]:
     return None
 
 
-def get_ssyoutube_links(link: str) -> Optional[YouTubeShortMedia]:
+def get_ssyoutube_links(
+    link: str,
+    limit: int = SIZE_LIMIT,
+) -> Optional[YouTubeShortMedia]:
     base = "https://ssyoutube.com/en6/"
     api = "https://ssyoutube.com/api/convert"
     # get cookies
-    s = requests.session()
-    s.get(url=base, headers=fake_headers)
-    log.debug(s.cookies.get_dict())
+    s = get_session(base)
     # get response
     response = None
     try:
-        response = requests.post(
+        response = s.post(
             url=api,
             headers={**fake_headers, "Referer": base},
             params={"url": link},
@@ -86,31 +197,29 @@ def get_ssyoutube_links(link: str) -> Optional[YouTubeShortMedia]:
         )
     except requests.exceptions.Timeout:
         log.warning("Read timed out.")
+    # cookies may be stale, warm again next time
+    if response is not None and not response.ok:
+        drop_session(base)
     if response:
         log.debug("Response: %r.", response.content)
         try:
             r = response.json()
             log.debug("JSON: %r.", r)
             if "meta" in r:
-                meta, videos = r["meta"], (
+                meta, videos = r["meta"], [
                     url
                     for url in r["url"]
                     if url.get("downloadable", True)
                     and url.get("audio", True)
                     and url.get("ext", "mp4") in ("webm", "mp4")
-                )
-                _link = next(videos)["url"]
-                _link_lq = next(videos, {}).get("url", _link)
-                if size := get_file_size(_link):
-                    return YouTubeShortMedia(
+                ]
+                if videos:
+                    media = get_media(
                         link,
                         r["id"],
                         r["thumb"],
                         meta["title"],
-                        _link,
-                        _link_lq,
-                        size,
-                        get_file_size(_link_lq),
+                        videos,
                         sum(
                             unit * mul
                             for unit, mul in zip(
@@ -118,7 +227,11 @@ def get_ssyoutube_links(link: str) -> Optional[YouTubeShortMedia]:
                                 (1, 60, 3600, 86400),
                             )
                         ),
+                        limit,
                     )
+                    if media:
+                        analytics.provider("ssyoutube")
+                    return media
             else:
                 log.error("Couldn't download video: %s.", r["message"])
         except json.decoder.JSONDecodeError as ex:
@@ -126,10 +239,23 @@ def get_ssyoutube_links(link: str) -> Optional[YouTubeShortMedia]:
     return None
 
 
-def get_youtube_short_links(link: str) -> Optional[YouTubeShortMedia]:
-    if not (ytsm := get_ytshorts_links(link)):  # best
+@analytics.timed("resolve")
+def get_youtube_short_links(
+    link: str,
+    limit: int = SIZE_LIMIT,
+) -> Optional[YouTubeShortMedia]:
+    """Get YouTube Short with the best format, which fits into size limit
+
+    Args:
+        link (str): YouTube Short link
+        limit (int, optional): max size. Defaults to SIZE_LIMIT.
+
+    Returns:
+        Optional[YouTubeShortMedia]: media, link is None if nothing fits
+    """
+    if not (ytsm := get_ytshorts_links(link, limit)):  # best
         log.warning("Trying another API: SSYouTube...")
-        if not (ytsm := get_ssyoutube_links(link)):  # good
+        if not (ytsm := get_ssyoutube_links(link, limit)):  # good
             log.warning("Couldn't get youtube content.")
             return None
     return ytsm
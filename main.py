@@ -1,21 +1,19 @@
-"""Main module"""
+"""Main module
+
+Heavy dependencies (tweepy, ffmpeg, PIL, magic) and extractors are imported
+on first use, to keep the start of the bot fast.
+"""
+import io
 import os
 import re
+import json
 import time
 import logging
 
+from typing import Any, Callable
 from pathlib import Path
 from functools import partial
 
-# http requests
-import requests
-
-# file extension check
-import magic
-
-# convert video files
-import ffmpeg
-
 # telegram core bot api
 from telegram import (
     Update,
@@ -32,7 +30,9 @@
 # telegram core bot api extension
 from telegram.ext import (
     Updater,
+    Dispatcher,
     CallbackContext,
+    TypeHandler,
     InlineQueryHandler,
     CommandHandler,
     MessageHandler,
@@ -49,10 +49,9 @@
 from telegram.utils.helpers import escape_markdown
 
 # working with database
+from sqlalchemy import not_
 from sqlalchemy.orm import Session
-
-# working with images
-from PIL import Image
+from sqlalchemy.dialects.postgresql import insert
 
 # import engine
 from db import engine
@@ -60,36 +59,49 @@
 # import database
 from db.models import Chat
 
+# job queue
+from db.queue import enqueue
+
 # import link types and other info
-from extra import LinkType, link_dict, TwitterStyle
+from extra import LinkType, link_dict, TwitterStyle, analytics, metrics
 
-# settings
-from extra.loggers import root_log, file_dir
+# memory budget of media
+from extra import budget
 
-# import fake headers
-from extra.helper import fake_headers
+# staged processing of multi-item posts
+from extra import pipeline
 
-# import namedtuples
-from extra.namedtuples import Link
+# repeated chat actions
+from extra import heartbeat
 
-# import tiktok api
-from extra.tiktok import get_tiktok_links
+# temporary media files
+from extra import spool
 
-# import twitter api
-from extra.twitter import get_twitter_links
+# update recorder
+from extra.recorder import RECORD_UPDATES, record
 
-# import youtube short
-from extra.youtube_short import get_youtube_short_links
+# settings
+from extra.loggers import root_log, setup as setup_loggers
 
-# import instagram api
-from extra.instagram import get_instagram_links
+# import max image sizes
+from extra.helper import IM_MAX, IM_SHR
 
-# uploading media
-from extra.upload import upload_log
+# import namedtuples
+from extra.namedtuples import InstaMedia, Link, TwitterMedia
 
 # setup logger
 log = logging.getLogger("yoiyoi.app")
 
+# hand messages over to worker processes
+JOB_QUEUE = bool(int(os.environ.get("JOB_QUEUE", "0")))
+
+# seconds to wait after every sent link
+SEND_DELAY = float(os.environ.get("SEND_DELAY", "5"))
+
+# self-hosted bot api server in local mode, e.g. "http://localhost:8081/bot"
+BOT_API_URL = os.environ.get("BOT_API_URL", "")
+BOT_API_FILE_URL = os.environ.get("BOT_API_FILE_URL", "")
+
 ################################################################################
 # telegram bot helpers
 ################################################################################
@@ -130,7 +142,9 @@ def handler(*args, **kwargs):
                 reply_to_message_id=args[0].effective_message.message_id,
                 text="\\[`ERROR`\\] Couldn't send message, try again later\\.",
             )
-            return None
+        # link isn't sent
+        analytics.outcome("error")
+        return None
 
     return handler
 
@@ -219,6 +233,10 @@ def notify(
 def formatter(query: str) -> list[Link]:
     """Exctract and format links in text
 
+    Short tiktok links are resolved to full ones. Duplicates (same link type
+    and id) are dropped, links are returned in order of their first
+    appearance in text.
+
     Args:
         query (str): text
 
@@ -227,17 +245,87 @@ def formatter(query: str) -> list[Link]:
     """
     if not query:
         return None
-    response = []
+    found = []
     for re_key, re_type in link_dict.items():
         for link in re.finditer(re_type["re"], query):
             # dictionary keys = format args
             _link = re_type["link"].format(**link.groupdict())
-            log.info("Received %s link: %r.", re_key, _link)
-            # add to response list
-            response.append(Link(re_type["type"], _link, link.group("id")))
+            log.debug("Found %s link: %r.", re_key, _link)
+            _id = link.group("id")
+            # resolve short tiktok link to video id
+            if re_key == "vtiktok":
+                from extra.tiktok import get_tiktok_id
+
+                if tid := get_tiktok_id(_link):
+                    _link = link_dict["tiktok"]["link"].format(id=tid)
+                    _id = tid
+            # remember position in text
+            found.append((link.start(), Link(re_type["type"], _link, _id)))
+    response, seen = [], set()
+    for _, link in sorted(found, key=lambda item: item[0]):
+        if (link.type, link.id) in seen:
+            log.debug("Skipped duplicate link: %r.", link.link)
+            continue
+        seen.add((link.type, link.id))
+        log.info(
+            "Received %s link: %r.", LinkType.getType(link.type), link.link
+        )
+        # add to response list
+        response.append(link)
     return response
 
 
+def chat_defaults(cht: Chat) -> dict:
+    """Get column values for new chat
+
+    Args:
+        cht (Chat): telegram chat
+
+    Returns:
+        dict: column values
+    """
+    is_not_user = cht.id < 0
+    return {
+        "id": cht.id,
+        "type": cht.type,
+        "name": cht.title if is_not_user else cht.full_name,
+        "chat_link": cht.username,
+        "tw_orig": is_not_user,
+        "tw_style": 2 if is_not_user else 0,
+        "tt_orig": is_not_user,
+        "in_orig": is_not_user,
+        "include_link": is_not_user,
+    }
+
+
+def update_chat(cht: Chat, attr: str, change: Callable) -> Any:
+    """Change chat setting with single statement, create chat if needed
+
+    Args:
+        cht (Chat): telegram chat
+        attr (str): attribute to change
+        change (Callable): function of old value, applied both to the column
+        of existing chat and to the default value of new chat
+
+    Returns:
+        Any: new value
+    """
+    values, column = chat_defaults(cht), Chat.__table__.c[attr]
+    values[attr] = change(values[attr])
+    with Session(engine) as s:
+        value = s.execute(
+            insert(Chat)
+            .values(**values)
+            .on_conflict_do_update(
+                index_elements=[Chat.id],
+                set_={attr: change(column)},
+            )
+            .returning(column)
+        ).scalar_one()
+        s.commit()
+    return value
+
+
 def toggler(update: Update, attr: str) -> bool:
     """Toggle state between True and False
 
@@ -248,36 +336,20 @@ def toggler(update: Update, attr: str) -> bool:
     Returns:
         bool: new state
     """
-    with Session(engine) as s:
-        u = s.get(Chat, update.effective_chat.id)
-        state = not getattr(u, attr)
-        setattr(u, attr, state)
-        s.commit()
-        notify(update, toggle=(attr, state))
-        return state
+    state = update_chat(update.effective_chat, attr, not_)
+    notify(update, toggle=(attr, state))
+    return state
 
 
 def get_chat(cht: Chat):
     with Session(engine) as session:
         session.expire_on_commit = False
-        is_not_user = cht.id < 0
+        values = chat_defaults(cht)
         if not (chat := session.get(Chat, cht.id)):
-            session.add(
-                chat := Chat(
-                    id=cht.id,
-                    type=cht.type,
-                    name=cht.title if is_not_user else cht.full_name,
-                    chat_link=cht.username,
-                    tw_orig=is_not_user,
-                    tw_style=2 if is_not_user else 0,
-                    tt_orig=is_not_user,
-                    in_orig=is_not_user,
-                    include_link=is_not_user,
-                )
-            )
+            session.add(chat := Chat(**values))
         else:
-            chat.name = cht.title if is_not_user else cht.full_name
-            chat.chat_link = cht.username
+            chat.name = values["name"]
+            chat.chat_link = values["chat_link"]
         session.commit()
         log.debug(chat)
     return chat
@@ -346,12 +418,12 @@ def command_include_link(update: Update, _) -> None:
 def command_tw_style(update: Update, _) -> None:
     """Change twitter style."""
     notify(update, command="/twitter_style")
-    # get old and new styles
-    with Session(engine) as s:
-        u = s.get(Chat, update.effective_chat.id)
-        style = TwitterStyle.styles[(u.tw_style + 1) % len(TwitterStyle.styles)]
-        u.tw_style = style
-        s.commit()
+    # get new style
+    style = update_chat(
+        update.effective_chat,
+        "tw_style",
+        lambda style: (style + 1) % len(TwitterStyle.styles),
+    )
     # demonstrate new style
     link = esc("https://twitter.com/")
     match style:
@@ -393,6 +465,8 @@ def inliner(update: Update, context: CallbackContext) -> None:
         }
         # send video if tiktok
         if in_link.type == LinkType.TIKTOK:
+            from extra.tiktok import get_tiktok_links
+
             if video := get_tiktok_links(in_link.link):
                 # check size
                 if video.size < 20 << 20:
@@ -419,12 +493,12 @@ def inliner(update: Update, context: CallbackContext) -> None:
             log.info("Inline: [#%02d] Error: %s.", in_id, text)
         # send youtube short
         elif in_link.type == LinkType.YOUTUBE_SHORT:
-            if video := get_youtube_short_links(in_link.link):
-                # check size
-                if 0 < video.size < 20 << 20:
+            from extra.youtube_short import get_youtube_short_links
+
+            if video := get_youtube_short_links(in_link.link, 20 << 20):
+                # the best format, which fits
+                if video.link:
                     data["video_url"] = video.link
-                elif 0 < video.size_lq < 20 << 20:
-                    data["video_url"] = video.link_lq
                 # upload video if any
                 if data.get("video_url", None):
                     data.update(
@@ -468,44 +542,177 @@ def inliner(update: Update, context: CallbackContext) -> None:
 # telegram text message handlers
 ################################################################################
 
-# max image side length
-IM_MAX = (2560, 2560)
+# telegram fetches files (except photos, up to 5 MB) by link up to this size
+URL_FILE_MAX = 20 << 20
+URL_PHOTO_MAX = 5 << 20
+
+# seconds to wait for telegram fetching media by link
+URL_TIMEOUT = int(os.environ.get("URL_TIMEOUT", "120"))
+
+# bot uploads files up to this size, local bot api server up to 2000 MB
+FILE_MAX = (2000 if BOT_API_URL else 50) << 20
+
+# bot downloads files to spool, so they have to fit into its quota
+DOWNLOAD_MAX = min(FILE_MAX, spool.SPOOL_QUOTA)
+
+
+def download(url: str) -> bytes:
+    """Download media
+
+    Args:
+        url (str): media link
+
+    Returns:
+        bytes: media content
+    """
+    # http requests
+    import requests
+
+    from extra.helper import fake_headers
+    from extra.cache import cache
+
+    with analytics.stage("download"):
+        # fresh copy on disk
+        if (meta := cache.lookup(url)) and meta["fresh"]:
+            budget.reserve(meta["size"])
+            if (content := cache.read(meta, "hit")) is not None:
+                return content
+        with requests.get(
+            url=url,
+            headers={**fake_headers, **cache.validators(meta)},
+            allow_redirects=True,
+            stream=True,
+        ) as r:
+            # copy on disk is still valid
+            if r.status_code == 304 and meta:
+                if not meta["fresh"]:
+                    budget.reserve(meta["size"])
+                content = cache.read(meta, "revalidated", r.headers)
+                # copy is gone meanwhile, download again
+                return download(url) if content is None else content
+            # wait for room in memory budget before reading
+            budget.reserve(size := int(r.headers.get("Content-Length", 0)))
+            content = r.content
+            if r.ok:
+                cache.store(url, r.headers, content)
+    # content of unknown size
+    budget.reserve(len(content) - size)
+    analytics.add_bytes(bytes_in=len(content))
+    return content
+
+
+def download_to(url: str, file: Path) -> Path:
+    """Download media straight to file, in parallel chunks, if possible
+
+    Args:
+        url (str): media link
+        file (Path): file without extension
+
+    Returns:
+        Path: file with extension by content
+    """
+    # parallel range downloads
+    from extra import ranges
 
-# shrinked max image side length
-IM_SHR = (2240, 2240)
+    with analytics.stage("download"):
+        # fail fast, if file doesn't fit into spool
+        size = ranges.download(url, file, check=spool.check)
+    with file.open("rb") as f:
+        ext = get_ext(f.read(2048))
+    analytics.add_bytes(bytes_in=size)
+    return file.rename(file.with_name(f"{file.name}.{ext}"))
 
 
+def read_media(file: Path) -> bytes:
+    """Read media file for upload, waiting for room in memory budget
+
+    Args:
+        file (Path): media file
+
+    Returns:
+        bytes: media content
+    """
+    budget.reserve(file.stat().st_size)
+    return file.read_bytes()
+
+
+def upload_media(file: Path) -> Path | bytes:
+    """Get media for upload: local bot api server reads file by its path,
+    public one gets its content
+
+    Args:
+        file (Path): media file
+
+    Returns:
+        Path | bytes: media file or its content
+    """
+    if BOT_API_URL:
+        return file
+    return read_media(file)
+
+
+def get_ext(content: bytes) -> str:
+    """Get file extension by content
+
+    Args:
+        content (bytes): file content
+
+    Returns:
+        str: file extension
+    """
+    # file extension check
+    import magic
+
+    return magic.from_buffer(content, mime=True).split("/")[1]
+
+
+@analytics.timed("convert")
 def to_png(image: bytes, filename: str = "temp") -> bytes:
+    # working with images
+    from PIL import Image
+
     # check extension
-    file_ext = magic.from_buffer(image, mime=True).split("/")[1]
+    file_ext = get_ext(image)
     log.info("Convert To PNG: Image extension: %s.", file_ext)
     # failed case
     if file_ext == "xml":
         log.info("Convert To PNG: XML: %r.", image.decode("utf-8"))
+    # jpeg, that already fits, is sent as is
+    if file_ext == "jpeg" and len(image) < 10 << 20:
+        try:
+            with Image.open(io.BytesIO(image)) as im:
+                if im.width <= IM_MAX[0] and im.height <= IM_MAX[1]:
+                    log.info("Convert To PNG: Fits: %d x %d.", *im.size)
+                    return image
+        except Exception as ex:
+            log.error("Convert To PNG: Exception occured: %s.", ex)
     # convert if needed
     if file_ext != "png":
-        # save as file
-        file = file_dir / f"{filename}.{file_ext}"
-        file.write_bytes(image)
-        try:
-            im = Image.open(file)
-            log.info("Convert To PNG: Original size: %d x %d.", *im.size)
-            log.debug("Convert To PNG: Fitting into %d x %d...", *IM_MAX)
-            im.thumbnail(IM_MAX)
-            log.debug("Convert To PNG: New size: %d x %d.", *im.size)
-            im.save(file, format="webp", lossless=True, optimize=True)
-            if (size := file.stat().st_size) > 10 << 20:
-                log.warning("Convert To PNG: File is bigger 10 MB: %d.", size)
-                file.write_bytes(image)
+        # save as file in spool
+        with spool.path(filename) as file:
+            file.write_bytes(image)
+            try:
                 im = Image.open(file)
-                log.debug("Convert To PNG: Fitting into %d x %d...", *IM_SHR)
-                im.thumbnail(IM_SHR)
+                log.info("Convert To PNG: Original size: %d x %d.", *im.size)
+                log.debug("Convert To PNG: Fitting into %d x %d...", *IM_MAX)
+                im.thumbnail(IM_MAX)
                 log.debug("Convert To PNG: New size: %d x %d.", *im.size)
                 im.save(file, format="webp", lossless=True, optimize=True)
-        except Exception as ex:
-            log.error("Convert To PNG: Exception occured: %s.", ex)
-        image = file.read_bytes()
-        file.unlink()
+                if (size := file.stat().st_size) > 10 << 20:
+                    log.warning(
+                        "Convert To PNG: File is bigger 10 MB: %d.", size
+                    )
+                    file.write_bytes(image)
+                    im = Image.open(file)
+                    log.debug(
+                        "Convert To PNG: Fitting into %d x %d...", *IM_SHR
+                    )
+                    im.thumbnail(IM_SHR)
+                    log.debug("Convert To PNG: New size: %d x %d.", *im.size)
+                    im.save(file, format="webp", lossless=True, optimize=True)
+            except Exception as ex:
+                log.error("Convert To PNG: Exception occured: %s.", ex)
+            image = read_media(file)
     return image
 
 
@@ -519,9 +726,48 @@ def get_text(update: Update):
     )
 
 
+def send_by_url(send: Callable, **kwargs) -> Message | list[Message] | None:
+    """Let telegram fetch media by link itself
+
+    Flood control is waited out. Timeouts are raised, not returned, because
+    telegram may still send media, so it mustn't be uploaded once again.
+
+    Args:
+        send (Callable): bot method, e.g. `send_video` or `send_media_group`
+
+    Returns:
+        Message | list[Message] | None: sent message(s) or None, if telegram
+        couldn't get media by link
+    """
+    tries = 1
+    max_tries = 3
+    while True:
+        try:
+            with analytics.stage("upload"):
+                return send(**kwargs, timeout=URL_TIMEOUT)
+        except RetryAfter as ex:
+            log.warning("Exception occured: %s.", ex)
+            if tries == max_tries:
+                raise
+            time.sleep(ex.retry_after + 1)
+        except BadRequest as ex:
+            log.warning("Telegram couldn't get media by link: %s.", ex)
+            return None
+        tries += 1
+        log.info("Retrying (%d try)...", tries)
+
+
 @exception_handler
 def send_media_group(_: Update, context: CallbackContext, **kwargs):
-    return context.bot.send_media_group(**kwargs)
+    with analytics.stage("upload"):
+        post = context.bot.send_media_group(**kwargs)
+    analytics.add_bytes(
+        bytes_out=sum(
+            len(getattr(item.media, "input_file_content", b""))
+            for item in kwargs["media"]
+        )
+    )
+    return post
 
 
 def send_tw(
@@ -529,7 +775,11 @@ def send_tw(
     context: CallbackContext,
     link: Link,
     chat: Chat,
+    media: TwitterMedia = None,
+    resolve_time: float = 0.0,
 ) -> None:
+    from extra.twitter import get_twitter_links
+
     notify(update, func="send_twitter")
     # prepare data
     mes = update.effective_message
@@ -539,7 +789,11 @@ def send_tw(
     }
     # get media
     log.info("Send Twitter: Link: %r.", link.link)
-    if media := get_twitter_links(link.id):
+    # looked up with other tweets of message
+    if media:
+        analytics.provider("twitter")
+        analytics.add_time("resolve", resolve_time)
+    if media := media or get_twitter_links(link.id):
         log.debug("Send Twitter: Media info: %r.", media)
         info = None
         if chat.include_link:
@@ -559,65 +813,100 @@ def send_tw(
                 case _:
                     info = _link
         if media.media == "photo":
-            photos, documents = [], []
-            for photo in media.links:
-                log.debug("Send Twitter: Link: %r.", photo)
-                log.debug("Send Twitter: Downloading...")
-                file = requests.get(
-                    url=photo,
-                    headers=fake_headers,
-                    allow_redirects=True,
-                )
-                log.debug("Send Twitter: Adding content to collection...")
-                filename = "{}.{}".format(
-                    re.search(link_dict["twitter"]["file"], photo)["id"],
-                    magic.from_buffer(file.content, mime=True).split("/")[1],
-                )
-                log.debug("Send Twitter: Filename: %r.", filename)
-                photos.append(
-                    InputMediaPhoto(
-                        to_png(image=file.content, filename=filename)
-                    )
-                )
-                documents.append(
-                    InputMediaDocument(
-                        media=file.content,
-                        filename=filename,
-                        disable_content_type_detection=True,
-                    )
-                )
-            log.debug("Send Twitter: Finished adding to collection.")
-            log.debug("Send Twitter: Changing caption to %r.", info)
+            # let telegram fetch previews (jpg, resized by twitter) by links
+            photos = [InputMediaPhoto(thumb) for thumb in media.thumbs]
             photos[0].caption = info
             photos[0].parse_mode = MDV2
-            log.info("Send Twitter: Sending media group...")
-            if chat.type == "private":
-                mes.chat.send_action(ChatAction.UPLOAD_PHOTO)
-            # send photo group
-            if post := send_media_group(update, context, **reply, media=photos):
+            log.info("Send Twitter: Sending media group by links...")
+            if post := send_by_url(
+                context.bot.send_media_group, **reply, media=photos
+            ):
                 log.info("Send Twitter: Sent media group.")
-            # send document group
-            if chat.tw_orig and post:
-                # documents[-1].caption = info
-                log.info("Send Twitter: Sending document group...")
-                if send_media_group(
-                    update,
-                    context,
-                    chat_id=mes.chat_id,
-                    reply_to_message_id=post[0].message_id,
-                    media=documents,
+
+            def fetch(job: tuple[str, str]) -> tuple:
+                photo, thumb = job
+                name = re.search(link_dict["twitter"]["file"], photo)["id"]
+                preview = original = None
+                # resized by twitter for preview
+                if not post:
+                    log.debug("Send Twitter: Link: %r.", thumb)
+                    log.debug("Send Twitter: Downloading...")
+                    preview = download(thumb)
+                # original only for documents
+                if chat.tw_orig:
+                    log.debug("Send Twitter: Link: %r.", photo)
+                    log.debug("Send Twitter: Downloading...")
+                    original = download(photo)
+                return name, preview, original
+
+            def convert(job: tuple) -> tuple:
+                name, preview, original = job
+                if preview:
+                    filename = f"{name}.{get_ext(preview)}"
+                    log.debug("Send Twitter: Filename: %r.", filename)
+                    preview = to_png(image=preview, filename=filename)
+                return name, preview, original
+
+            # show upload, while photos are prepared and sent, if any
+            with heartbeat.action(
+                context.bot,
+                mes.chat_id,
+                ChatAction.UPLOAD_DOCUMENT if post else ChatAction.UPLOAD_PHOTO,
+                chat.type == "private" and (not post or chat.tw_orig),
+            ):
+                # download next photos, while current ones are converted
+                photos, documents = [], []
+                for name, preview, original in pipeline.run(
+                    zip(media.links, media.thumbs), fetch, convert
                 ):
-                    log.info("Send Twitter: Sent document group.")
+                    log.debug("Send Twitter: Adding content to collection...")
+                    if preview:
+                        photos.append(InputMediaPhoto(preview))
+                    if original:
+                        filename = f"{name}.{get_ext(original)}"
+                        log.debug("Send Twitter: Filename: %r.", filename)
+                        documents.append(
+                            InputMediaDocument(
+                                media=original,
+                                filename=filename,
+                                disable_content_type_detection=True,
+                            )
+                        )
+                log.debug("Send Twitter: Finished adding to collection.")
+                # send photo group, if telegram couldn't get it
+                if photos:
+                    log.debug("Send Twitter: Changing caption to %r.", info)
+                    photos[0].caption = info
+                    photos[0].parse_mode = MDV2
+                    log.info("Send Twitter: Sending media group...")
+                    if post := send_media_group(
+                        update, context, **reply, media=photos
+                    ):
+                        log.info("Send Twitter: Sent media group.")
+                # send document group
+                if chat.tw_orig and post:
+                    # documents[-1].caption = info
+                    log.info("Send Twitter: Sending document group...")
+                    if send_media_group(
+                        update,
+                        context,
+                        chat_id=mes.chat_id,
+                        reply_to_message_id=post[0].message_id,
+                        media=documents,
+                    ):
+                        log.info("Send Twitter: Sent document group.")
         else:
             # send video and gifs as is
             log.info("Send Twitter: Sending media as is...")
             for media in media.links:
-                if context.bot.send_document(
-                    **reply,
-                    caption=info,
-                    document=media,
-                    parse_mode=MDV2,
-                ):
+                with analytics.stage("upload"):
+                    post = context.bot.send_document(
+                        **reply,
+                        caption=info,
+                        document=media,
+                        parse_mode=MDV2,
+                    )
+                if post:
                     log.info("Send Twitter: Sent media.")
         return
     else:
@@ -625,6 +914,7 @@ def send_tw(
             f"[This twitter content]({link.link}) can't be found or "
             "downloaded\\. If this seems to be wrong, try again later\\."
         )
+        analytics.outcome("not_found")
         log.error("Send Twitter: Couldn't get content.")
     send_error(update, text)
 
@@ -635,6 +925,8 @@ def send_tt(
     link: Link,
     chat: Chat,
 ) -> None:
+    from extra.tiktok import get_tiktok_links
+
     notify(update, func="send_tiktok")
     # prepare data
     mes = update.effective_message
@@ -647,49 +939,67 @@ def send_tt(
     if video := get_tiktok_links(link.link):
         info = video.source if chat.include_link else None
         # check size
-        if video.size < 50 << 20:
-            if chat.tt_orig and video.size_hd < 50 << 20:
-                reply["video"] = video.link_hd
+        if video.size < DOWNLOAD_MAX:
+            if chat.tt_orig and video.size_hd < DOWNLOAD_MAX:
+                reply["video"], size = video.link_hd, video.size_hd
             else:
-                reply["video"] = video.link
-            # download
-            vid = requests.get(
-                url=reply["video"],
-                headers=fake_headers,
-                allow_redirects=True,
+                reply["video"], size = video.link, video.size
+            # let telegram fetch video by link
+            if size < URL_FILE_MAX:
+                log.info("Send Tiktok: Sending video by link...")
+                if send_by_url(context.bot.send_video, **reply, caption=info):
+                    return log.info("Send Tiktok: Sent video.")
+            # show upload, while video is prepared and sent
+            uploading = heartbeat.action(
+                context.bot,
+                mes.chat_id,
+                ChatAction.UPLOAD_VIDEO,
+                chat.type == "private",
             )
-            # check extension
-            file_ext = magic.from_buffer(vid.content, mime=True).split("/")[1]
-            # save as file
-            filename = f"{video.id}-{mes.chat_id}.{file_ext}"
-            file = file_dir / filename
-            file.write_bytes(vid.content)
-            # convert if needed
-            if file_ext != "mp4":
-                log.warning("Send Tiktok: File extension: %s.", file_ext)
-                mp4 = file_dir / f"{video.id}.mp4"
-                log.info("Send Tiktok: Converting...")
-                ffmpeg.input(str(file)).output(str(mp4)).run()
-                reply["video"] = mp4.read_bytes()
-                mp4.unlink()
-            else:
-                reply["video"] = file.read_bytes()
-            # notify user
-            if chat.type == "private":
-                mes.chat.send_action(ChatAction.UPLOAD_VIDEO)
-            # upload
-            log.info("Send Tiktok: Sending video...")
-            if context.bot.send_video(
-                **reply,
-                caption=info,
-                filename=f"{video.id}.mp4",
-            ):
-                log.info("Send Tiktok: Sent video.")
-            # delete
-            file.unlink()
-            return
+            try:
+                # spooled files are removed on exit, even on errors
+                with spool.path(video.id) as path, uploading:
+                    # download to file, keeping video out of memory
+                    file = download_to(reply["video"], path)
+                    # check extension
+                    file_ext = file.suffix[1:]
+                    # convert if needed
+                    if file_ext != "mp4":
+                        log.warning(
+                            "Send Tiktok: File extension: %s.", file_ext
+                        )
+                        mp4 = path.with_name(f"{path.name}.mp4")
+                        log.info("Send Tiktok: Converting...")
+                        with analytics.stage("ffmpeg"):
+                            # convert video files
+                            import ffmpeg
+
+                            ffmpeg.input(str(file)).output(str(mp4)).run()
+                        file = mp4
+                    reply["video"] = upload_media(file)
+                    # upload
+                    log.info("Send Tiktok: Sending video...")
+                    with analytics.stage("upload"):
+                        post = context.bot.send_video(
+                            **reply,
+                            caption=info,
+                            filename=f"{video.id}.mp4",
+                        )
+                    if post:
+                        analytics.add_bytes(bytes_out=file.stat().st_size)
+                        log.info("Send Tiktok: Sent video.")
+                return
+            # no room for video right now
+            except spool.SpoolFull as ex:
+                log.warning("Send Tiktok: %s", ex)
+                analytics.outcome("spool_full")
+                text = (
+                    "Sorry, there is no room for this video right now\\. "
+                    "Try again later\\."
+                )
         # if file is too big
         else:
+            analytics.outcome("too_big")
             text = "Sorry, this file is too big\\!"
     # if there is no video
     else:
@@ -697,6 +1007,7 @@ def send_tt(
             f"[This tiktok content]({link.link}) can't be found or "
             "downloaded\\. If this seems to be wrong, try again later\\."
         )
+        analytics.outcome("not_found")
         log.error("Send Tiktok: Couldn't get content.")
     send_error(update, text)
 
@@ -707,6 +1018,11 @@ def send_in(
     link: Link,
     chat: Chat,
 ) -> None:
+    from concurrent.futures import ThreadPoolExecutor
+
+    from extra.helper import get_file_size
+    from extra.instagram import get_instagram_links
+
     notify(update, func="send_instagram")
     # prepare data
     mes = update.effective_message
@@ -717,61 +1033,131 @@ def send_in(
     # get media
     log.info("Send Instagram: Link: %r.", link.link)
     if media := get_instagram_links(link.link):
-        files, documents = [], []
         info = media[0].source if chat.include_link else None
-        for item in media:
+        # telegram sends up to 10 items in media group
+        groups = [media[n : n + 10] for n in range(0, len(media), 10)]
+        posts = []
+        # telegram fetches photos up to 5 MB and videos up to 20 MB by links
+        with ThreadPoolExecutor(4) as pool:
+            sizes = dict(
+                zip(
+                    (item.link for item in media),
+                    pool.map(get_file_size, (item.link for item in media)),
+                )
+            )
+        # let telegram fetch media by links
+        for n, group in enumerate(groups):
+            if any(
+                sizes[item.link]
+                > (URL_PHOTO_MAX if item.type == "image" else URL_FILE_MAX)
+                for item in group
+            ):
+                log.info("Send Instagram: Media group is too big for links.")
+                posts.append(None)
+                continue
+            files = [
+                (
+                    InputMediaPhoto(item.link)
+                    if item.type == "image"
+                    else InputMediaVideo(item.link)
+                )
+                for item in group
+            ]
+            files[0].caption = info if n == 0 else None
+            log.info("Send Instagram: Sending media group by links...")
+            if post := send_by_url(
+                context.bot.send_media_group, **reply, media=files
+            ):
+                log.info("Send Instagram: Sent media group.")
+            posts.append(post)
+        # only originals are needed, if media is sent by links
+        items = [
+            (n, item)
+            for n, group in enumerate(groups)
+            for item in group
+            if not posts[n] or (chat.in_orig and item.type == "image")
+        ]
+
+        def fetch(job: tuple[int, InstaMedia]) -> tuple:
+            n, item = job
             log.debug("Send Instagram: Link: %r.", item.link)
             log.debug("Send Instagram: Downloading...")
-            file = requests.get(
-                item.link,
-                headers=fake_headers,
-                allow_redirects=True,
-            )
-            log.debug("Send Instagram: Adding content to collection...")
+            content = download(item.link)
             filename = "{}.{}".format(
                 re.search(link_dict["instagram"]["file"], item.link)["id"],
-                magic.from_buffer(file.content, mime=True).split("/")[1],
+                get_ext(content),
             )
             log.debug("Send Instagram: Filename: %r.", filename)
-            if item.type == "image":
-                if chat.type == "private":
-                    mes.chat.send_action(ChatAction.UPLOAD_PHOTO)
-                files.append(InputMediaPhoto(to_png(file.content, filename)))
-                documents.append(
-                    InputMediaDocument(
-                        media=file.content,
-                        filename=filename,
-                        disable_content_type_detection=True,
+            return n, item, content, filename
+
+        def convert(job: tuple) -> tuple:
+            n, item, content, filename = job
+            image = None
+            if item.type == "image" and not posts[n]:
+                image = to_png(content, filename)
+            return n, item, content, filename, image
+
+        # show upload, while items are prepared and sent
+        with heartbeat.action(
+            context.bot,
+            mes.chat_id,
+            (
+                ChatAction.UPLOAD_VIDEO
+                if any(item.type == "video" for _, item in items)
+                else ChatAction.UPLOAD_PHOTO
+            ),
+            chat.type == "private" and bool(items),
+        ):
+            # download next items, while current ones are converted and sent
+            files, documents = [], []
+            for i, (n, item, content, filename, image) in enumerate(
+                pipeline.run(items, fetch, convert)
+            ):
+                log.debug("Send Instagram: Adding content to collection...")
+                if item.type == "image":
+                    if image:
+                        files.append(InputMediaPhoto(image))
+                    documents.append(
+                        InputMediaDocument(
+                            media=content,
+                            filename=filename,
+                            disable_content_type_detection=True,
+                        )
                     )
-                )
-            if item.type == "video":
-                if chat.type == "private":
-                    mes.chat.send_action(ChatAction.UPLOAD_VIDEO)
-                files.append(
-                    InputMediaVideo(
-                        media=file.content,
-                        filename=filename,
+                if item.type == "video":
+                    files.append(
+                        InputMediaVideo(
+                            media=content,
+                            filename=filename,
+                        )
                     )
-                )
-        log.debug("Send Instagram: Finished adding to collection.")
-        log.debug("Send Instagram: Changing caption to: %r.", info)
-        files[0].caption = info
-        log.info("Send Instagram: Sending media group...")
-        # send file group
-        if post := send_media_group(update, context, **reply, media=files):
-            log.info("Send Instagram: Sent media group.")
-        # send document group
-        if chat.in_orig and documents and post:
-            # documents[-1].caption = info
-            log.info("Send Instagram: Sending document group...")
-            if send_media_group(
-                update,
-                context,
-                chat_id=mes.chat_id,
-                reply_to_message_id=post[0].message_id,
-                media=documents,
-            ):
-                log.info("Send Instagram: Sent document group.")
+                # send group, as soon as its last item is ready
+                if i + 1 < len(items) and items[i + 1][0] == n:
+                    continue
+                log.debug("Send Instagram: Finished adding to collection.")
+                # send file group, if telegram couldn't get it
+                if files:
+                    log.debug("Send Instagram: Changing caption to: %r.", info)
+                    files[0].caption = info if n == 0 else None
+                    log.info("Send Instagram: Sending media group...")
+                    posts[n] = send_media_group(
+                        update, context, **reply, media=files
+                    )
+                    if posts[n]:
+                        log.info("Send Instagram: Sent media group.")
+                # send document group
+                if chat.in_orig and documents and posts[n]:
+                    # documents[-1].caption = info
+                    log.info("Send Instagram: Sending document group...")
+                    if send_media_group(
+                        update,
+                        context,
+                        chat_id=mes.chat_id,
+                        reply_to_message_id=posts[n][0].message_id,
+                        media=documents,
+                    ):
+                        log.info("Send Instagram: Sent document group.")
+                files, documents = [], []
         return
     # if no links returned
     else:
@@ -779,6 +1165,7 @@ def send_in(
             f"[This instagram content]({link.link}) can't be found or "
             "downloaded\\. If this seems to be wrong, try again later\\."
         )
+        analytics.outcome("not_found")
         log.error("Send Instagram: Couldn't get content.")
     send_error(update, text)
 
@@ -789,6 +1176,8 @@ def send_yts(
     link: Link,
     chat: Chat,
 ) -> None:
+    from extra.youtube_short import get_youtube_short_links
+
     notify(update, func="send_youtube_short")
     # prepare data
     mes = update.effective_message
@@ -798,53 +1187,69 @@ def send_yts(
     }
     # get media
     log.info("Send YouTube Short: Link: %r.", link.link)
-    if video := get_youtube_short_links(link.link):
+    if video := get_youtube_short_links(link.link, DOWNLOAD_MAX):
         info = video.source if chat.include_link else None
-        # check size
-        if 0 < video.size < 50 << 20:
-            reply["video"] = video.link
-        elif 0 < video.size_lq < 50 << 20:
-            reply["video"] = video.link_lq
+        # the best format, which fits
+        if video.link:
+            reply["video"], size = video.link, video.size
         # upload video if any
         if reply.get("video", None):
-            # download
-            vid = requests.get(
-                url=reply["video"],
-                headers=fake_headers,
-                allow_redirects=True,
+            # let telegram fetch video by link
+            if size < URL_FILE_MAX:
+                log.info("Send YouTube Short: Sending video by link...")
+                if send_by_url(context.bot.send_video, **reply, caption=info):
+                    return log.info("Send YouTube Short: Sent video.")
+            # show upload, while video is prepared and sent
+            uploading = heartbeat.action(
+                context.bot,
+                mes.chat_id,
+                ChatAction.UPLOAD_VIDEO,
+                chat.type == "private",
             )
-            # check extension
-            file_ext = magic.from_buffer(vid.content, mime=True).split("/")[1]
-            # save as file
-            filename = f"{video.id}-{mes.chat_id}.{file_ext}"
-            file = file_dir / filename
-            file.write_bytes(vid.content)
-            # convert if needed
-            if file_ext != "mp4":
-                log.warning("Send YouTube Short: File extension: %s.", file_ext)
-                mp4 = file_dir / f"{video.id}.mp4"
-                log.info("Send YouTube Short: Converting...")
-                ffmpeg.input(str(file)).output(str(mp4)).run()
-                reply["video"] = mp4.read_bytes()
-                mp4.unlink()
-            else:
-                reply["video"] = file.read_bytes()
-            # notify user
-            if chat.type == "private":
-                mes.chat.send_action(ChatAction.UPLOAD_VIDEO)
-            # upload
-            log.info("Send YouTube Short: Sending video...")
-            if context.bot.send_video(
-                **reply,
-                caption=info,
-                filename=f"{video.id}.mp4",
-            ):
-                log.info("Send YouTube Short: Sent video.")
-            # delete
-            file.unlink()
-            return
+            try:
+                # spooled files are removed on exit, even on errors
+                with spool.path(video.id) as path, uploading:
+                    # download to file, keeping video out of memory
+                    file = download_to(reply["video"], path)
+                    # check extension
+                    file_ext = file.suffix[1:]
+                    # convert if needed
+                    if file_ext != "mp4":
+                        log.warning(
+                            "Send YouTube Short: File extension: %s.", file_ext
+                        )
+                        mp4 = path.with_name(f"{path.name}.mp4")
+                        log.info("Send YouTube Short: Converting...")
+                        with analytics.stage("ffmpeg"):
+                            # convert video files
+                            import ffmpeg
+
+                            ffmpeg.input(str(file)).output(str(mp4)).run()
+                        file = mp4
+                    reply["video"] = upload_media(file)
+                    # upload
+                    log.info("Send YouTube Short: Sending video...")
+                    with analytics.stage("upload"):
+                        post = context.bot.send_video(
+                            **reply,
+                            caption=info,
+                            filename=f"{video.id}.mp4",
+                        )
+                    if post:
+                        analytics.add_bytes(bytes_out=file.stat().st_size)
+                        log.info("Send YouTube Short: Sent video.")
+                return
+            # no room for video right now
+            except spool.SpoolFull as ex:
+                log.warning("Send YouTube Short: %s", ex)
+                analytics.outcome("spool_full")
+                text = (
+                    "Sorry, there is no room for this video right now\\. "
+                    "Try again later\\."
+                )
         # if file is too big
         else:
+            analytics.outcome("too_big")
             text = "Sorry, this file is too big\\!"
     # if there is no video
     else:
@@ -852,40 +1257,85 @@ def send_yts(
             f"[This youtube content]({link.link}) can't be found or "
             "downloaded\\. If this seems to be wrong, try again later\\."
         )
+        analytics.outcome("not_found")
         log.error("Send YouTube Short: Couldn't get content.")
     send_error(update, text)
 
 
-def echo(update: Update, context: CallbackContext) -> None:
-    """Answers to user's links
+def send_links(
+    update: Update,
+    context: CallbackContext,
+    links: list[Link],
+    chat: Chat,
+    done: Callable[[Link], None] | None = None,
+) -> None:
+    """Send media for every link
 
     Args:
         update (Update): telegram update object
         context (CallbackContext): telegram context object
+        links (list[Link]): links found in message
+        chat (Chat): chat settings
+        done (Callable[[Link], None] | None, optional): called with every
+        sent link. Defaults to None.
     """
-    notify(update, func="echo")
-    # check for text
-    if not (text := get_text(update)):
-        # no text found!
-        return log.info("Echo: No text.")
-    log.debug("Echo: Received text: %r.", text)
-    chat = get_chat(update.effective_chat)
-    func = None
-    for link in formatter(text):
+    func, tweets, share = None, {}, 0.0
+    # look up all tweets at once, every link gets its share of time
+    tids = [link.id for link in links if link.type == LinkType.TWITTER]
+    if len(tids) > 1:
+        from extra.twitter import get_twitter_tweets
+
+        start = time.perf_counter()
+        tweets = get_twitter_tweets(tids)
+        share = (time.perf_counter() - start) / len(tids)
+    for link in links:
         match link.type:
             case LinkType.INSTAGRAM:
                 func = send_in
             case LinkType.TIKTOK:
                 func = send_tt
             case LinkType.TWITTER:
-                func = send_tw
+                func = partial(
+                    send_tw,
+                    media=tweets.get(link.id, None),
+                    resolve_time=share,
+                )
             case LinkType.YOUTUBE_SHORT:
                 func = send_yts
             case _:
                 send_reply(update, esc(link.link))
                 continue
-        func(update, context, link, chat)
-        time.sleep(5)
+        with analytics.track(chat.id, link.type), budget.scope():
+            func(update, context, link, chat)
+        if done:
+            done(link)
+        time.sleep(SEND_DELAY)
+
+
+def echo(update: Update, context: CallbackContext) -> None:
+    """Answers to user's links
+
+    Args:
+        update (Update): telegram update object
+        context (CallbackContext): telegram context object
+    """
+    notify(update, func="echo")
+    # check for text
+    if not (text := get_text(update)):
+        # no text found!
+        return log.info("Echo: No text.")
+    log.debug("Echo: Received text: %r.", text)
+    chat = get_chat(update.effective_chat)
+    if not (links := formatter(text)):
+        return log.info("Echo: No links.")
+    # let workers do the job
+    if JOB_QUEUE:
+        job = enqueue(
+            "echo",
+            json.dumps({"update": update.to_dict(), "links": links}),
+        )
+        return log.info("Echo: Enqueued job #%d.", job)
+    send_links(update, context, links, chat)
 
 
 ################################################################################
@@ -893,19 +1343,15 @@ def echo(update: Update, context: CallbackContext) -> None:
 ################################################################################
 
 
-def main() -> None:
-    """Set up and run the bot"""
-    # create updater & dispatcher
-    updater = Updater(os.environ["TOKEN"])
+def add_handlers(dispatcher: Dispatcher) -> None:
+    """Add handlers of the bot to dispatcher
 
-    # start bot
-    updater.start_webhook(
-        listen="0.0.0.0",
-        port=int(os.environ.get("PORT", "8443")),
-        url_path=os.environ["TOKEN"],
-        webhook_url=f"https://{os.environ['APP_NAME']}.herokuapp.com/{os.environ['TOKEN']}",
-    )
-    dispatcher = updater.dispatcher
+    Args:
+        dispatcher (Dispatcher): telegram dispatcher object
+    """
+    # record updates for replay
+    if RECORD_UPDATES:
+        dispatcher.add_handler(TypeHandler(Update, record), group=-1)
 
     # start the bot
     dispatcher.add_handler(CommandHandler("start", command_start))
@@ -942,13 +1388,61 @@ def main() -> None:
         )
     )
 
+
+def get_updater() -> Updater:
+    """Create updater, which talks to local bot api server, if set"""
+    return Updater(
+        os.environ["TOKEN"],
+        base_url=BOT_API_URL or None,
+        base_file_url=BOT_API_FILE_URL or None,
+    )
+
+
+def main() -> None:
+    """Set up and run the bot"""
+    # remove files left by crashed runs
+    spool.sweep()
+
+    # create updater & dispatcher
+    updater = get_updater()
+
+    # start bot
+    updater.start_webhook(
+        listen="0.0.0.0",
+        port=int(os.environ.get("PORT", "8443")),
+        url_path=os.environ["TOKEN"],
+        webhook_url=f"https://{os.environ['APP_NAME']}.herokuapp.com/{os.environ['TOKEN']}",
+    )
+    dispatcher = updater.dispatcher
+
+    # flush analytics in background
+    analytics.start()
+
+    # ship closed log files in background
+    from extra import upload
+
+    upload.start()
+
+    # serve metrics next to webhook
+    metrics.start()
+    metrics.watch_queue("updates", dispatcher.update_queue.qsize)
+    metrics.watch_queue("workers", dispatcher._Dispatcher__async_queue.qsize)
+
+    # add handlers
+    add_handlers(dispatcher)
+
     # stop the bot
     updater.idle()
 
 
 if __name__ == "__main__":
+    setup_loggers()
     root_log.info("Starting the bot...")
     # start the bot
     main()
+    # flush analytics
+    analytics.flush()
     # upload log
+    from extra.upload import upload_log
+
     upload_log()
@@ -0,0 +1,18 @@
+"""Shared fixtures: stand-in services of `bench.fakes`"""
+import pytest
+
+from requests.adapters import HTTPAdapter
+
+from bench import fakes
+from bench.load import redirect
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """Stand-in services, every `requests` call is sent to them"""
+    server = fakes.start(latency={"*": 0.0})
+    # restored after test
+    monkeypatch.setattr(HTTPAdapter, "send", HTTPAdapter.send)
+    redirect(server.server_address[1])
+    yield server
+    server.shutdown()
@@ -0,0 +1,34 @@
+"""Media cache: index of files left on disk"""
+import os
+import json
+
+from extra import cache
+
+
+def touch(file, content: bytes = b"data", age: float = 0) -> None:
+    file.write_bytes(content)
+    if age:
+        mtime = file.stat().st_mtime - age
+        os.utime(file, (mtime, mtime))
+
+
+def test_load_removes_leftovers(tmp_path):
+    touch(tmp_path / "kept")
+    (tmp_path / "kept.json").write_text(json.dumps({"size": 4}))
+    # crashed before metadata was written
+    touch(tmp_path / "orphan", age=cache.LEFTOVER_AGE + 1)
+    touch(tmp_path / "orphan.1.tmp", age=cache.LEFTOVER_AGE + 1)
+    touch(tmp_path / "kept.1.json.tmp", age=cache.LEFTOVER_AGE + 1)
+    # metadata of removed content
+    (tmp_path / "gone.json").write_text(json.dumps({"size": 4}))
+    # may be written by another process right now
+    touch(tmp_path / "fresh.2.tmp")
+    c = cache.Cache(tmp_path, 1 << 20)
+    c.load()
+    assert dict(c.index) == {"kept": 4}
+    assert c.size == 4
+    assert sorted(f.name for f in tmp_path.iterdir()) == [
+        "fresh.2.tmp",
+        "kept",
+        "kept.json",
+    ]
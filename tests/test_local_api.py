@@ -0,0 +1,77 @@
+"""Local Bot API mode: uploads by path and raised size limit"""
+import importlib
+
+import pytest
+
+from bench.load import make_bot, make_update, root
+
+tiktok = "https://www.tiktok.com/@bench/video/7000000000000000001"
+
+
+@pytest.fixture
+def bot_env(server, tmp_path, monkeypatch):
+    """Environment of the bot, which talks to stand-in services"""
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path}/test.db")
+    monkeypatch.setenv("PATH_SETTINGS", str(root / "settings.toml"))
+    monkeypatch.setenv("TW_TOKEN", "test")
+    monkeypatch.setenv("TOKEN", "123456:test")
+    monkeypatch.setenv("JOB_QUEUE", "0")
+    monkeypatch.setenv("SEND_DELAY", "0")
+    monkeypatch.setenv("SPOOL_DIR", str(tmp_path))
+    # videos are too big to be fetched by link
+    server.mp4 = server.mp4.ljust(21 << 20, b"\0")
+    return server
+
+
+def load_main(monkeypatch, api_url: str):
+    """Import main module with given bot api server"""
+    monkeypatch.setenv("BOT_API_URL", api_url)
+    import main
+
+    return importlib.reload(main)
+
+
+def send_tiktok(bot, port: int) -> None:
+    from telegram import Update
+    from telegram.ext import Updater, CallbackContext
+
+    tg = make_bot(port, 4)
+    context = CallbackContext(Updater(bot=tg).dispatcher)
+    bot.echo(Update.de_json(make_update(1, "echo", tiktok, 1), tg), context)
+
+
+def test_local_mode(bot_env, monkeypatch):
+    port = bot_env.server_address[1]
+    bot = load_main(
+        monkeypatch, f"http://127.0.0.1:{port}/api.telegram.org/bot"
+    )
+    assert bot.FILE_MAX == 2000 << 20
+    send_tiktok(bot, port)
+    # uploaded by file:// path, read by server from disk
+    assert bot_env.stats["local_files"] == 1
+    assert bot_env.stats["local_bytes"] == len(bot_env.mp4)
+
+
+def test_public_mode(bot_env, monkeypatch):
+    bot = load_main(monkeypatch, "")
+    assert bot.FILE_MAX == 50 << 20
+    send_tiktok(bot, bot_env.server_address[1])
+    assert bot_env.stats["telegram"] > 0
+    assert bot_env.stats["local_files"] == 0
+
+
+def test_bigger_than_spool(bot_env, monkeypatch):
+    from extra import spool
+
+    monkeypatch.setattr(spool, "SPOOL_QUOTA", 1 << 20)
+    port = bot_env.server_address[1]
+    bot = load_main(
+        monkeypatch, f"http://127.0.0.1:{port}/api.telegram.org/bot"
+    )
+    assert bot.DOWNLOAD_MAX == 1 << 20
+    downloads = []
+    monkeypatch.setattr(bot, "download_to", lambda *args: downloads.append(1))
+    send_tiktok(bot, port)
+    # too big right away, nothing is downloaded
+    assert not downloads
+    assert bot_env.stats["local_files"] == 0
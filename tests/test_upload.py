@@ -0,0 +1,82 @@
+"""Log shipping: chunked upload and resume protocol"""
+import json
+import gzip
+
+import pytest
+
+from extra import loggers, upload
+
+link = "https://script.google.com/macros/s/bench/exec"
+
+
+@pytest.fixture
+def log_file(tmp_path, monkeypatch):
+    """Log file of several small chunks"""
+    monkeypatch.setattr(upload, "CHUNK_SIZE", 3 << 10)
+    file = tmp_path / "yoiyoi_test.log"
+    file.write_bytes(bytes(range(256)) * 50)
+    return file
+
+
+def ship(file, offsets: dict) -> bool:
+    return upload.ship_file(link, file, offsets, file.parent / "upload.json")
+
+
+def test_ship_in_chunks(server, log_file):
+    offsets = {}
+    assert ship(log_file, offsets)
+    assert server.uploads[log_file.name] == log_file.read_bytes()
+    assert offsets[log_file.name] == log_file.stat().st_size
+    saved = json.loads((log_file.parent / "upload.json").read_text())
+    assert saved == offsets
+
+
+def test_resume_from_server_offset(server, log_file):
+    # server already has the first chunk, client doesn't know it
+    server.uploads[log_file.name] = bytearray(log_file.read_bytes()[:3072])
+    assert ship(log_file, {})
+    assert server.uploads[log_file.name] == log_file.read_bytes()
+
+
+def test_resume_after_failure(server, log_file):
+    offsets = {}
+    server.config.values["fail"]["upload"] = 1.0
+    assert not ship(log_file, offsets)
+    assert offsets.get(log_file.name, 0) == 0
+    server.config.values["fail"]["upload"] = 0.0
+    assert ship(log_file, offsets)
+    assert server.uploads[log_file.name] == log_file.read_bytes()
+
+
+def reply(content: dict):
+    return type("R", (), {"json": lambda self: content})()
+
+
+def test_existing_file_without_offset(log_file, monkeypatch):
+    monkeypatch.setattr(
+        upload.requests, "post", lambda **_: reply({"ok": False})
+    )
+    # name is taken before anything is sent
+    offsets = {}
+    assert ship(log_file, offsets)
+    assert offsets[log_file.name] == log_file.stat().st_size
+
+
+def test_reply_without_offset_keeps_offset(log_file, monkeypatch):
+    replies = iter([{"ok": True}, {"ok": False}])
+    monkeypatch.setattr(
+        upload.requests, "post", lambda **_: reply(next(replies))
+    )
+    # rest of the file isn't marked as shipped
+    offsets = {}
+    assert not ship(log_file, offsets)
+    assert offsets[log_file.name] == 3 << 10
+
+
+def test_compressed_segment_appears_complete(tmp_path):
+    source = tmp_path / "yoiyoi_test.log"
+    source.write_bytes(b"line\n" * 1000)
+    dest = tmp_path / "yoiyoi_test.001.log.gz"
+    loggers.compress_segment(str(source), str(dest))
+    assert gzip.decompress(dest.read_bytes()) == b"line\n" * 1000
+    assert [f.name for f in tmp_path.iterdir()] == [dest.name]
@@ -0,0 +1,88 @@
+"""Worker module"""
+import os
+import json
+import time
+import logging
+
+# telegram core bot api
+from telegram import Update
+
+# telegram core bot api extension
+from telegram.ext import CallbackContext
+
+# job queue
+from db.queue import claim, finish, pending
+
+# analytics
+from extra import analytics, metrics, spool
+
+# settings
+from extra.loggers import root_log, setup as setup_loggers
+
+# import namedtuples
+from extra.namedtuples import Link
+
+# telegram bot
+from main import get_chat, get_updater, send_links
+
+# setup logger
+log = logging.getLogger("yoiyoi.worker")
+
+# seconds to wait when queue is empty
+POLL_TIMEOUT = 1
+
+
+def work(context: CallbackContext) -> None:
+    """Claim and process jobs until stopped
+
+    Args:
+        context (CallbackContext): telegram context object
+    """
+    while True:
+        if not (job := claim()):
+            time.sleep(POLL_TIMEOUT)
+            continue
+        log.info("Worker: Processing %s job #%d...", job.kind, job.id)
+        # links, which are sent, aren't sent again on retry
+        data, sent = None, []
+        try:
+            match job.kind:
+                case "echo":
+                    data = json.loads(job.payload)
+                    update = Update.de_json(data["update"], context.bot)
+                    send_links(
+                        update,
+                        context,
+                        [Link(*link) for link in data["links"]],
+                        get_chat(update.effective_chat),
+                        done=sent.append,
+                    )
+                case _:
+                    raise ValueError(f"Unknown job kind: {job.kind!r}.")
+        except Exception as ex:
+            log.error("Worker: Job #%d failed: %s.", job.id, ex)
+            if data and sent:
+                log.info("Worker: %d links are already sent.", len(sent))
+                data["links"] = data["links"][len(sent) :]
+                finish(job, ok=False, payload=json.dumps(data))
+            else:
+                finish(job, ok=False)
+        else:
+            log.info("Worker: Finished job #%d.", job.id)
+            finish(job)
+
+
+def main() -> None:
+    """Set up and run the worker"""
+    updater = get_updater()
+    spool.sweep()
+    analytics.start()
+    metrics.start(int(os.environ.get("WORKER_METRICS_PORT", "9091")))
+    metrics.watch_queue("jobs", pending)
+    work(CallbackContext(updater.dispatcher))
+
+
+if __name__ == "__main__":
+    setup_loggers()
+    root_log.info("Starting the worker...")
+    main()